@@ -3,7 +3,12 @@
 import os
 import sys
 import asyncio
+import argparse
+import sqlite3
+import traceback
+from time import monotonic
 from gql import gql, Client, WebsocketsTransport
+from graphql import GraphQLError
 import requests
 
 from abc import ABC, abstractmethod
@@ -19,9 +24,20 @@ if module_path not in sys.path:
     sys.path.append(module_path)
 
 from impl.utils.debug_print import activate_debug, debug_print, debug_pprint
+from impl.utils.profiling import activate_profiling, stop_profiling
 from impl.api.client import AiDungeonApiClient
-from impl.conf import Config
-from impl.user_interaction import UserIo, TermIo, TermIoSlowStory
+from impl.conf import Config, UnknownProfile, InvalidConfig
+from impl.scenario_catalog import ScenarioCatalog, ScenarioNotFound
+from impl.story_index import StoryIndex, StoryIndexUnavailable
+from impl.loadtest.runner import LoadTest
+from impl.user_interaction import UserIo, TermIo, TermIoSlowStory, JsonLinesIo
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: each alternative is a concurrent generation on the API side
+MAX_RETRY_ALTERNATIVES = 5
 
 
 # -------------------------------------------------------------------------
@@ -36,7 +52,8 @@ class QuitSession(Exception):
 # GAME LOGIC
 
 class AbstractAiDungeonGame(ABC):
-    def __init__(self, api: AiDungeonApiClient, conf: Config, user_io: UserIo):
+    def __init__(self, api: AiDungeonApiClient, conf: Config, user_io: UserIo,
+                 story_index: StoryIndex = None):
         self.stop_session: bool = False
 
         self.user_id: str = None
@@ -59,6 +76,7 @@ class AbstractAiDungeonGame(ABC):
         self.api = api
         self.conf = conf
         self.user_io = user_io
+        self.story_index = story_index
 
     def update_session_auth(self):
         self.session.headers.update({"X-Access-Token": self.conf.auth_token})
@@ -97,6 +115,14 @@ class AbstractAiDungeonGame(ABC):
     def make_user_choose_config(self):
         pass
 
+    def display_story(self, text: str):
+        self.user_io.handle_story_output(text)
+        self.record_story(text)
+
+    def record_story(self, text: str):
+        if self.story_index is not None:
+            self.story_index.add(self.adventure_id, text)
+
     # Initialize story
     def init_story(self):
         pass
@@ -112,6 +138,37 @@ class AbstractAiDungeonGame(ABC):
     def process_remember_action(self, user_input: str):
         pass
 
+    # Function for when /retry is typed
+    def process_retry_action(self, user_input: str):
+        pass
+
+    # Function for when /search is typed
+    def process_search_action(self, user_input: str):
+        if self.story_index is None:
+            self.user_io.handle_basic_output("Search is not available.")
+            return
+        if not user_input.strip():
+            self.user_io.handle_basic_output("Usage: /search <terms>")
+            return
+        results = self.story_index.search(user_input)
+        if not results:
+            self.user_io.handle_basic_output("No match.")
+            return
+        self.user_io.handle_basic_output("\n".join(str(r) for r in results))
+
+    # Function for when /history is typed
+    def process_history_action(self, user_input: str):
+        page = user_input.strip()
+        if page and not page.isdigit():
+            self.user_io.handle_basic_output("Usage: /history [<page>]")
+            return
+        self.user_io.display_history(int(page) if page else 1)
+
+    # Function for when /traffic is typed
+    def process_traffic_action(self):
+        lines = self.api.traffic.report()
+        self.user_io.handle_basic_output("\n".join(lines) if lines else "No traffic yet.")
+
     # Function that is called each iteration to process user inputs
     def process_next_action(self):
         user_input = self.user_io.handle_user_input()
@@ -122,6 +179,14 @@ class AbstractAiDungeonGame(ABC):
         else:
             if user_input.startswith("/remember"):
                 self.process_remember_action(user_input[len("/remember "):])
+            elif user_input.startswith("/history"):
+                self.process_history_action(user_input[len("/history "):])
+            elif user_input.startswith("/retry"):
+                self.process_retry_action(user_input[len("/retry "):])
+            elif user_input.startswith("/search"):
+                self.process_search_action(user_input[len("/search "):])
+            elif user_input == "/traffic":
+                self.process_traffic_action()
             else:
                 self.process_regular_action(user_input)
 
@@ -134,8 +199,9 @@ class AbstractAiDungeonGame(ABC):
 ## --------------------------------
 
 class AiDungeonGame(AbstractAiDungeonGame):
-    def __init__(self, api: AiDungeonApiClient, conf: Config, user_io: UserIo):
-        super().__init__(api, conf, user_io)
+    def __init__(self, api: AiDungeonApiClient, conf: Config, user_io: UserIo,
+                 story_index: StoryIndex = None):
+        super().__init__(api, conf, user_io, story_index)
 
 
     def login(self):
@@ -153,7 +219,11 @@ class AiDungeonGame(AbstractAiDungeonGame):
 
 
     def _choose_character_name(self):
-        print("Enter your character's name...\n")
+        if self.conf.character_name:
+            self.character_name = self.conf.character_name
+            return
+
+        self.user_io.handle_basic_output("Enter your character's name...")
 
         character_name = self.user_io.handle_user_input()
 
@@ -176,14 +246,14 @@ class AiDungeonGame(AbstractAiDungeonGame):
 
         prompt, settings = self.api.get_options(self.api.single_player_mode_id)
 
-        print(prompt + "\n")
+        self.user_io.handle_basic_output(prompt)
 
         setting_select_dict = {}
         for i, setting in settings.items():
             setting_id, setting_name = setting
-            print(str(i) + ") " + setting_name)
             setting_select_dict[str(i)] = setting_name
             # setting_select_dict['0'] = '0' # secret mode
+        self.user_io.handle_options_output(setting_select_dict)
         selected_i = self.choose_selection(setting_select_dict, 'k')
         setting_id, self.setting_name = settings[selected_i]
         self.scenario_id = setting_id
@@ -201,14 +271,14 @@ class AiDungeonGame(AbstractAiDungeonGame):
                                                                 self.character_name)
                     return
 
-                print(prompt + "\n")
+                self.user_io.handle_basic_output(prompt)
 
                 select_dict = {}
                 for i, option in options.items():
                     option_id, option_name = option
-                    print(str(i) + ") " + option_name)
                     select_dict[str(i)] = option_name
                     # setting_select_dict['0'] = '0' # secret mode
+                self.user_io.handle_options_output(select_dict)
                 selected_i = self.choose_selection(select_dict, 'k')
                 option_id, option_name = options[selected_i]
                 self.scenario_id = option_id
@@ -218,13 +288,13 @@ class AiDungeonGame(AbstractAiDungeonGame):
 
         prompt, characters = self.api.get_characters(self.scenario_id)
 
-        print(prompt + "\n")
+        self.user_io.handle_basic_output(prompt)
 
         character_select_dict = {}
         for i, character in characters.items():
             character_id, character_type = character
-            print(str(i) + ") " + character_type)
             character_select_dict[str(i)] = character_type
+        self.user_io.handle_options_output(character_select_dict)
         selected_i = self.choose_selection(character_select_dict, 'k')
         character_id, character_type = characters[selected_i]
         self.scenario_id = character_id # TODO: create a setter instead
@@ -238,6 +308,25 @@ class AiDungeonGame(AbstractAiDungeonGame):
                                                      self.character_name)
 
 
+    def choose_config_from_scenario_path(self, scenario_path: str):
+        catalog = ScenarioCatalog.loaded()
+        if catalog is None:
+            self.user_io.handle_basic_output("Indexing scenarios... Please wait...")
+            catalog = ScenarioCatalog.crawled(self.api)
+            catalog.save()
+
+        entry = catalog.resolve(scenario_path)
+        self.setting_name = entry.setting_name
+        self.scenario_id = entry.scenario_id
+        if self.setting_name == "custom":
+            return
+
+        self._choose_character_name()
+        self.story_pitch_template = entry.prompt
+        self.story_pitch = self.api.make_story_pitch(self.story_pitch_template,
+                                                     self.character_name)
+
+
     # Initialize story
     def init_story(self):
         if self.is_multiplayer:
@@ -245,11 +334,13 @@ class AiDungeonGame(AbstractAiDungeonGame):
         elif self.setting_name == "custom":
             self.init_story_custom()
         else:
-            print("Generating story... Please wait...\n")
+            self.user_io.handle_basic_output("Generating story... Please wait...")
+            start = monotonic()
             self.adventure_id, self.public_id, self.story_pitch, self.quests = self.api.init_story(self.scenario_id,
                                                                                 self.story_pitch)
+            self.user_io.handle_timing("init_story", monotonic() - start)
 
-        self.user_io.handle_story_output(self.story_pitch)
+        self.display_story(self.story_pitch)
 
 
     def init_story_custom(self):
@@ -293,13 +384,49 @@ class AiDungeonGame(AbstractAiDungeonGame):
 
         (action, user_input) = self.find_action_type(user_input)
 
+        start = monotonic()
         resp = self.api.perform_regular_action(self.adventure_id, action, user_input, self.character_name)
+        self.user_io.handle_timing("regular_action", monotonic() - start)
 
-        self.user_io.handle_story_output(resp)
+        self.display_story(resp)
 
     def process_remember_action(self, user_input: str):
         self.api.perform_remember_action(user_input, self.adventure_id)
 
+    def process_retry_action(self, user_input: str):
+        try:
+            count = int(user_input) if user_input.strip() else 1
+        except ValueError:
+            count = 0
+        if not 1 <= count <= MAX_RETRY_ALTERNATIVES:
+            self.user_io.handle_basic_output(
+                "Usage: /retry [<number of alternatives, 1 to {}>]".format(MAX_RETRY_ALTERNATIVES))
+            return
+
+        start = monotonic()
+        alternatives = []
+        for action_id, text in self.api.perform_retry_actions(self.adventure_id, count):
+            alternatives.append([action_id, text])
+            if count > 1:
+                self.user_io.handle_basic_output("Alternative #{}:".format(len(alternatives)))
+            self.user_io.handle_story_output(text)
+        self.user_io.handle_timing("retry_action", monotonic() - start)
+
+        if count == 1:
+            self.record_story(alternatives[0][1])
+            return
+
+        self.user_io.handle_basic_output("Which alternative do you want to keep?")
+        select_dict = {str(i): "Alternative #{}".format(i) for i in range(1, len(alternatives) + 1)}
+        self.user_io.handle_options_output(select_dict)
+        selected_i = self.choose_selection(select_dict, 'k')
+        _, text = alternatives[int(selected_i) - 1]
+        # NB: the adventure holds whichever retry the server processed last, which
+        # is not necessarily the last one we got an answer for
+        last_action_id = self.api.get_last_action_id(self.adventure_id)
+        self.api.perform_alter_action(self.adventure_id, last_action_id, text)
+        self.record_story(text)
+
     def process_next_action(self):
         user_input = self.user_io.handle_user_input()
 
@@ -310,6 +437,14 @@ class AiDungeonGame(AbstractAiDungeonGame):
             if user_input.startswith("/remember"):
                 # pass
                 self.process_remember_action(user_input[len("/remember "):])
+            elif user_input.startswith("/history"):
+                self.process_history_action(user_input[len("/history "):])
+            elif user_input.startswith("/retry"):
+                self.process_retry_action(user_input[len("/retry "):])
+            elif user_input.startswith("/search"):
+                self.process_search_action(user_input[len("/search "):])
+            elif user_input == "/traffic":
+                self.process_traffic_action()
             else:
                 self.process_regular_action(user_input)
 
@@ -317,27 +452,109 @@ class AiDungeonGame(AbstractAiDungeonGame):
 # -------------------------------------------------------------------------
 # MAIN
 
+def search_main(args):
+    parser = argparse.ArgumentParser(prog='ai-dungeon-cli search',
+                                     description='search through the story of past adventures')
+    parser.add_argument("terms", nargs='+', help="terms to search for")
+    parser.add_argument("--limit", type=int, default=10, help="maximum number of results")
+    parsed = parser.parse_args(args)
+
+    try:
+        story_index = StoryIndex()
+    except StoryIndexUnavailable as err:
+        print(err)
+        exit(1)
+    try:
+        for result in story_index.search(' '.join(parsed.terms), parsed.limit):
+            print(result)
+    finally:
+        story_index.close()
+
+
+def loadtest_main(args):
+    parser = argparse.ArgumentParser(prog='ai-dungeon-cli loadtest',
+                                     description='run simulated players for a long time, to measure performance and catch leaks')
+    parser.add_argument("--players", type=int, default=10, help="maximum number of concurrent players")
+    parser.add_argument("--ramp-step", type=int, default=1, help="number of players added at each ramp step")
+    parser.add_argument("--ramp-interval", type=float, default=10, help="seconds between ramp steps")
+    parser.add_argument("--duration", type=float, default=3600, help="duration of the test, in seconds")
+    parser.add_argument("--report-interval", type=float, default=30, help="seconds between stats samples")
+    parser.add_argument("--think-time", type=float, default=2, help="average seconds between a player's turns")
+    parser.add_argument("--turns-per-session", type=int, default=20, help="turns played before a player starts a new session")
+    parser.add_argument("--server-latency", type=float, default=0.5, help="average story generation time of the stand-in server")
+    parser.add_argument("--url", type=str, required=False, help="server to test, instead of an in-process stand-in one")
+    parser.add_argument("--output", type=str, required=False, help="CSV file to append stats samples to")
+    parser.add_argument("--profile", type=str, action='append',
+                        help="profile (from the config file) for players to use, can be repeated to alternate between several")
+    parser.add_argument("--all-profiles", action='store_const', const=True,
+                        help="have players alternate between all the profiles of the config file")
+    parsed = parser.parse_args(args)
+
+    try:
+        if parsed.all_profiles:
+            configs = list(Config.profiles_loaded_from_file().values())
+            if not configs:
+                parser.error("no profiles in config file")
+        elif parsed.profile:
+            configs = [Config.loaded_from_file(profile) for profile in parsed.profile]
+        else:
+            configs = None
+    except (UnknownProfile, InvalidConfig) as err:
+        print(err)
+        exit(1)
+
+    if parsed.url and not (configs and all(conf.scenario for conf in configs)):
+        parser.error("with --url, players need profiles with a scenario to start (see --profile)")
+
+    LoadTest(AiDungeonGame, parsed.players, parsed.ramp_step, parsed.ramp_interval,
+             parsed.duration, parsed.report_interval, parsed.think_time,
+             parsed.turns_per_session, parsed.server_latency, parsed.url, parsed.output,
+             configs).run()
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "search":
+        search_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "loadtest":
+        loadtest_main(sys.argv[2:])
+        return
+
+    term_io = None
+    api_client = None
+    story_index = None
 
     try:
         # Initialize the configuration from config file
-        file_conf = Config.loaded_from_file()
         cli_args_conf = Config.loaded_from_cli_args()
+        file_conf = Config.loaded_from_file(cli_args_conf.profile)
         conf = Config.merged([file_conf, cli_args_conf])
 
         if conf.debug:
             activate_debug()
 
+        if conf.profile_output:
+            activate_profiling(conf.profile_output)
+
         # Initialize the terminal I/O class
-        if conf.slow_typing_effect:
+        if conf.io_mode == "json":
+            term_io = JsonLinesIo(conf.prompt)
+        elif conf.slow_typing_effect:
             term_io = TermIoSlowStory(conf.prompt)
         else:
             term_io = TermIo(conf.prompt)
 
-        api_client = AiDungeonApiClient()
+        api_client = AiDungeonApiClient(compression=conf.compression,
+                                        max_window_bits=conf.max_window_bits,
+                                        max_message_size=conf.max_message_size)
+
+        try:
+            story_index = StoryIndex()
+        except (StoryIndexUnavailable, sqlite3.Error, OSError) as err:
+            debug_print("story won't be indexed: {}".format(err))
 
         # Initialize the game logic class with the given auth_token and prompt
-        ai_dungeon = AiDungeonGame(api_client, conf, term_io)
+        ai_dungeon = AiDungeonGame(api_client, conf, term_io, story_index)
 
         # Clears the console
         term_io.clear()
@@ -346,12 +563,13 @@ def main():
         ai_dungeon.login()
 
         # Displays the splash image accordingly
-        if term_io.get_width() >= 80:
-            term_io.display_splash()
+        term_io.display_splash()
 
         # Loads the current session configuration
         if conf.public_adventure_id:
             ai_dungeon.join_multiplayer()
+        elif conf.scenario:
+            ai_dungeon.choose_config_from_scenario_path(conf.scenario)
         else:
             ai_dungeon.make_user_choose_config()
 
@@ -364,6 +582,14 @@ def main():
     except QuitSession:
         term_io.handle_basic_output("Bye Bye!")
 
+    except (UnknownProfile, InvalidConfig) as err:
+        print(err)
+        exit(1)
+
+    except ScenarioNotFound as err:
+        term_io.handle_error_output(str(err))
+        exit(1)
+
     except EOFError:
         term_io.handle_basic_output("Received Keyboard Interrupt. Bye Bye...")
 
@@ -371,23 +597,41 @@ def main():
         term_io.handle_basic_output("Received Keyboard Interrupt. Bye Bye...")
 
     except requests.exceptions.TooManyRedirects:
-        term_io.handle_basic_output("Exceded max allowed number of HTTP redirects, API backend has probably changed")
+        term_io.handle_error_output("Exceded max allowed number of HTTP redirects, API backend has probably changed")
         exit(1)
 
     except requests.exceptions.HTTPError as err:
-        term_io.handle_basic_output("Unexpected response from API backend:")
-        term_io.handle_basic_output(err)
+        term_io.handle_error_output("Unexpected response from API backend: {}".format(err))
         exit(1)
 
     except ConnectionError:
-        term_io.handle_basic_output("Lost connection to the Ai Dungeon servers")
+        term_io.handle_error_output("Lost connection to the Ai Dungeon servers")
+        exit(1)
+
+    except GraphQLError as err:
+        term_io.handle_error_output("Operation rejected by the API schema, API backend has probably changed: {}".format(err.message))
         exit(1)
 
     except requests.exceptions.RequestException as err:
-        term_io.handle_basic_output("Totally unexpected exception:")
-        term_io.handle_basic_output(err)
+        term_io.handle_error_output("Totally unexpected exception: {}".format(err))
         exit(1)
 
+    except Exception as err:
+        if term_io is None:
+            raise
+        # NB: e.g. gql's TransportQueryError or TransportClosed, reported as an
+        # `error` event in JSON mode rather than as a traceback
+        debug_print(traceback.format_exc())
+        term_io.handle_error_output("Unexpected error ({}): {}".format(type(err).__name__, err))
+        exit(1)
+
+    finally:
+        if api_client:
+            api_client.close()
+        if story_index:
+            story_index.close()
+        stop_profiling()
+
 
 if __name__ == "__main__":
     main()
@@ -1,50 +1,141 @@
 import asyncio
-from gql import gql, Client, WebsocketsTransport
+import hashlib
+from gql import gql, Client
+from graphql import validate
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
 
 from impl.utils.debug_print import debug_print, debug_pprint
+from impl.api.codec import get_codec
+from impl.api.transport import CodecWebsocketsTransport
+from impl.api.metering import TrafficCounters
+from impl.api.schema_cache import SchemaCache
+from impl.api.supervisor import ConnectionSupervisor
+
+
+# -------------------------------------------------------------------------
+# UTILS
+
+def operations_stamp() -> str:
+    """hash of this module, which declares all operations, for the schema cache"""
+    try:
+        with open(__file__, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return ''
+
+
+def make_connect_args(compression: str = "deflate", max_window_bits: int = None,
+                      max_message_size: int = 2 ** 20):
+    """arguments for `websockets.connect`
+
+    `compression` is either 'deflate' (permessage-deflate gets negotiated) or
+    'off'. Lower `max_window_bits` (9 to 15) use less memory on both ends at
+    the cost of a worse ratio. `max_message_size` is the largest message that
+    gets accepted (a long adventure's history can exceed the default 1MiB),
+    0 meaning no limit.
+    """
+    connect_args = {"max_size": max_message_size or None}
+    if compression == "off":
+        connect_args["compression"] = None
+    elif compression == "deflate":
+        if max_window_bits:
+            connect_args["extensions"] = [ClientPerMessageDeflateFactory(
+                client_max_window_bits=max_window_bits,
+                server_max_window_bits=max_window_bits)]
+    else:
+        raise ValueError("unsupported compression: {}".format(compression))
+    return connect_args
 
 
 # -------------------------------------------------------------------------
 # API CLIENT
 
 class AiDungeonApiClient:
-    def __init__(self):
-        self.url: str = 'wss://api.aidungeon.io/subscriptions'
-        self.websocket = WebsocketsTransport(url=self.url)
-        self.gql_client = Client(transport=self.websocket,
-                                 # fetch_schema_from_transport=True,
-        )
+    def __init__(self, json_codec: str = None, ping_interval: float = 30,
+                 url: str = 'wss://api.aidungeon.io/subscriptions', use_schema_cache: bool = True,
+                 compression: str = "deflate", max_window_bits: int = None, max_message_size: int = 2 ** 20):
+        self.url: str = url
+        self.codec = get_codec(json_codec)
+        self.connect_args = make_connect_args(compression, max_window_bits, max_message_size)
+        self.traffic = TrafficCounters()
+        self.init_payload = {}
+        self.supervisor = ConnectionSupervisor(self._make_client, ping_interval)
         self.account_id: str = ''
         self.access_token: str = ''
 
         self.single_player_mode_id: str = 'scenario:458612'
 
+        # NB: operations get parsed and validated against the cached schema only once
+        self.documents = {}
+        self.schema_cache = SchemaCache(self.url, stamp=operations_stamp())
+        if use_schema_cache:
+            self.schema_cache.load()
+            if self.schema_cache.is_stale():
+                self.schema_cache.refresh_in_background(self._make_transport)
+
+
+    def _document(self, query):
+        document = self.documents.get(query)
+        if document is None:
+            document = gql(query)
+            self._validate(document)
+            self.documents[query] = document
+        return document
+
+
+    def _validate(self, document):
+        schema = self.schema_cache.schema
+        if schema is None:
+            return
+        validation_errors = validate(schema, document)
+        if validation_errors and not self.schema_cache.refreshed:
+            # NB: the cached schema may predate the API changes this client got adapted to
+            debug_print("operation rejected by cached schema ({}), refreshing it".format(validation_errors[0]))
+            if not self.schema_cache.refresh(self._make_transport):
+                # NB: let the API be the judge
+                self.schema_cache.schema = None
+                return
+            validation_errors = validate(self.schema_cache.schema, document)
+        if validation_errors:
+            raise validation_errors[0]
+
 
     async def _execute_query_pseudo_async(self, query, params={}):
-        async with Client(
-                transport=self.websocket,
-                # fetch_schema_from_transport=True,
-        ) as session:
-            return await session.execute(gql(query), variable_values=params)
+        return await self.supervisor.execute_async(self._document(query), params)
 
 
     def _execute_query(self, query, params=None):
-        return self.gql_client.execute(gql(query), variable_values=params)
+        return self.supervisor.execute(self._document(query), params)
 
 
-    def update_session_access_token(self, access_token):
-        self.websocket = WebsocketsTransport(
-            url=self.url,
-            init_payload={'token': access_token})
-        self.gql_client = Client(transport=self.websocket,
-                                 # fetch_schema_from_transport=True,
+    def _make_transport(self, init_payload={}):
+        return CodecWebsocketsTransport(url=self.url,
+                                        init_payload=init_payload,
+                                        connect_args=self.connect_args,
+                                        codec=self.codec,
+                                        traffic=self.traffic)
+
+
+    def _make_client(self):
+        return Client(transport=self._make_transport(self.init_payload),
+                      # fetch_schema_from_transport=True,
         )
 
 
+    def update_session_access_token(self, access_token):
+        self.init_payload = {'token': access_token}
+        # NB: new connection gets authenticated with the token
+        self.supervisor.reconnect_in_background()
+
+
+    def close(self):
+        self.supervisor.close()
+
+
     def user_login(self, email, password):
         debug_print("user login")
         result = self._execute_query('''
-        mutation ($email: String, $password: String, $anonymousId: String) {  login(email: $email, password: $password, anonymousId: $anonymousId) {    id    accessToken    __typename  }}
+        mutation ($email: String, $password: String, $anonymousId: String) {  login(email: $email, password: $password, anonymousId: $anonymousId) {    id    accessToken  }}
         ''',
                                      {
                                          "email": email ,
@@ -60,7 +151,7 @@ class AiDungeonApiClient:
     def anonymous_login(self):
         debug_print("anonymous login")
         result = self._execute_query('''
-        mutation {  createAnonymousAccount {    id    accessToken    __typename  }}
+        mutation {  createAnonymousAccount {    id    accessToken  }}
         ''')
         debug_print(result)
         self.account_id = result['createAnonymousAccount']['id']
@@ -117,7 +208,7 @@ class AiDungeonApiClient:
 
         debug_print("query options (variant #1)")
         result = self._execute_query('''
-        query ($id: String) {  user {    id    username    __typename  }  content(id: $id) {    id    userId    contentType    contentId    prompt    gameState    options {      id      title      __typename    }    playPublicId    __typename  }}
+        query ($id: String) {  content(id: $id) {    id    prompt    options {      id      title    }  }}
         ''',
                                      {"id": scenario_id})
         debug_print(result)
@@ -157,7 +248,7 @@ class AiDungeonApiClient:
 
         debug_print("query settings singleplayer (variant #1)")
         result = self._execute_query('''
-        query ($id: String) {  user {    id    username    __typename  }  content(id: $id) {    id    userId    contentType    contentId    prompt    gameState    options {      id      title      __typename    }    playPublicId    __typename  }}
+        query ($id: String) {  content(id: $id) {    id    prompt    options {      id      title    }  }}
         ''',
                                      {"id": scenario_id})
         debug_print(result)
@@ -180,7 +271,7 @@ class AiDungeonApiClient:
 
         debug_print("query get story for scenario")
         result = self._execute_query('''
-        query ($id: String) {  user {    id    username    __typename  }  content(id: $id) {    id    userId    contentType    contentId    prompt    gameState    options {      id      title      __typename    }    playPublicId    __typename  }}
+        query ($id: String) {  content(id: $id) {    id    prompt  }}
         ''',
                                      {"id": scenario_id})
         debug_print(result)
@@ -213,7 +304,7 @@ class AiDungeonApiClient:
 
         debug_print("send custom settings story pitch")
         result = self._execute_query('''
-        mutation ($input: ContentActionInput) {  sendAction(input: $input) {    id    actionLoading    memory    died    gameState    newQuests {      id      text      completed      active      __typename    }    actions {      id      text      __typename    }    __typename  }}
+        mutation ($input: ContentActionInput) {  sendAction(input: $input) {    id    actions {      text    }  }}
         ''',
                                      {
                                          "input": {
@@ -227,7 +318,7 @@ class AiDungeonApiClient:
     def create_adventure(self, scenario_id, story_pitch):
         debug_print("create adventure")
         result = self._execute_query('''
-        mutation ($id: String, $prompt: String) {  createAdventureFromScenarioId(id: $id, prompt: $prompt) {    id    contentType    contentId    title    description    musicTheme    tags    nsfw    published    createdAt    updatedAt    deletedAt    publicId    historyList    __typename  }}
+        mutation ($id: String, $prompt: String) {  createAdventureFromScenarioId(id: $id, prompt: $prompt) {    id    historyList  }}
         ''',
                                      {
                                          "id": scenario_id,
@@ -245,7 +336,7 @@ class AiDungeonApiClient:
     def init_story_multi_adventure(self, public_adventure_id):
         debug_print("get story multi-user adventure")
         result = self._execute_query('''
-        query ($id: String, $playPublicId: String) {  content(id: $id, playPublicId: $playPublicId) {    id    actions {      id      text      __typename    }    quests    newQuests {      id      text      completed      active      __typename    }    playPublicId    userId    __typename  }}
+        query ($id: String, $playPublicId: String) {  content(id: $id, playPublicId: $playPublicId) {    id    actions {      text      __typename    }  }}
         ''',
                                      {"playPublicId": public_adventure_id})
         debug_print(result)
@@ -265,7 +356,7 @@ class AiDungeonApiClient:
 
         debug_print("get created adventure ids")
         result = self._execute_query('''
-        query ($id: String, $playPublicId: String) {  content(id: $id, playPublicId: $playPublicId) {    id    historyList    quests    playPublicId    userId    __typename  }}
+        query ($id: String, $playPublicId: String) {  content(id: $id, playPublicId: $playPublicId) {    id    quests    playPublicId  }}
         ''',
                                      {
                                          "id": adventure_id,
@@ -282,7 +373,7 @@ class AiDungeonApiClient:
     def perform_remember_action(self, user_input, adventure_id):
         debug_print("remember something")
         result = self._execute_query('''
-        mutation ($input: ContentActionInput) {  updateMemory(input: $input) {    id    memory    __typename  }}
+        mutation ($input: ContentActionInput) {  updateMemory(input: $input) {    id  }}
         ''',
                                      {
                                          "input":
@@ -301,7 +392,7 @@ class AiDungeonApiClient:
 
         debug_print("send regular action")
         result = self._execute_query('''
-        mutation ($input: ContentActionInput) {  sendAction(input: $input) {    id    actionLoading    memory    died    gameState    __typename  }}
+        mutation ($input: ContentActionInput) {  sendAction(input: $input) {    id  }}
         ''',
                                      {
                                          "input": {
@@ -320,7 +411,6 @@ class AiDungeonApiClient:
             content(id: $id, playPublicId: $playPublicId) {
                 id
                 actions {
-                    id
                     text
                 }
             }
@@ -333,3 +423,77 @@ class AiDungeonApiClient:
         story_continuation = result['content']['actions'][-1]['text']
 
         return story_continuation
+
+
+    def perform_retry_actions(self, adventure_id, count):
+        """generate `count` alternative continuations for the last action
+
+        All are requested concurrently over the shared connection. They get yielded
+        as [action_id, text] pairs in order of completion.
+        """
+        document = self._document('''
+        mutation ($input: ContentActionInput) {  sendAction(input: $input) {    id    actions {      id      text    }  }}
+        ''')
+        params = {
+            "input": {
+                "type": "retry",
+                "text": "",
+                "id": adventure_id
+            }
+        }
+
+        async def retries():
+            # NB: through the supervisor, so that no keepalive ping (which could time
+            # out while the server is busy) tears down the connection meanwhile
+            tasks = [asyncio.ensure_future(self.supervisor.execute_async(document, params))
+                     for _ in range(count)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    debug_print(result)
+                    last_action = result['sendAction']['actions'][-1]
+                    yield [last_action['id'], last_action['text']]
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        async def next_retry():
+            return await generator.__anext__()
+
+        debug_print("send {} concurrent retry actions".format(count))
+        generator = retries()
+        try:
+            while True:
+                yield self.supervisor.run(next_retry())
+        except StopAsyncIteration:
+            pass
+        finally:
+            self.supervisor.run(generator.aclose())
+
+
+    def get_last_action_id(self, adventure_id):
+        debug_print("get last action id")
+        result = self._execute_query('''
+        query ($id: String) {  content(id: $id) {    id    actions {      id    }  }}
+        ''',
+                                     {
+                                         "id": adventure_id
+                                     })
+        debug_print(result)
+        return result['content']['actions'][-1]['id']
+
+
+    def perform_alter_action(self, adventure_id, action_id, text):
+        debug_print("alter action")
+        result = self._execute_query('''
+        mutation ($input: ContentActionInput) {  sendAction(input: $input) {    id  }}
+        ''',
+                                     {
+                                         "input": {
+                                             "type": "alter",
+                                             "text": text,
+                                             "id": adventure_id,
+                                             "actionId": action_id
+                                         }
+                                     })
+        debug_print(result)
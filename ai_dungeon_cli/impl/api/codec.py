@@ -0,0 +1,72 @@
+import json
+
+
+# -------------------------------------------------------------------------
+# CODECS
+
+class JsonCodec:
+    """standard library `json`, always available"""
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        return json.dumps(obj)
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    @staticmethod
+    def loads(data):
+        import orjson
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        import orjson
+        return orjson.dumps(obj).decode('utf8')
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    @staticmethod
+    def loads(data):
+        import ujson
+        return ujson.loads(data)
+
+    @staticmethod
+    def dumps(obj) -> str:
+        import ujson
+        return ujson.dumps(obj)
+
+
+# NB: by order of preference
+CODECS = [OrjsonCodec, UjsonCodec, JsonCodec]
+
+
+# -------------------------------------------------------------------------
+# FNS
+
+def is_available(codec) -> bool:
+    if codec is JsonCodec:
+        return True
+    try:
+        __import__(codec.name)
+        return True
+    except ImportError:
+        return False
+
+
+def get_codec(name: str = None):
+    """fastest available codec, or the one called `name` if available"""
+    for codec in CODECS:
+        if name and codec.name != name:
+            continue
+        if is_available(codec):
+            return codec
+    return JsonCodec
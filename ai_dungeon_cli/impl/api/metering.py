@@ -0,0 +1,129 @@
+from collections import deque
+from typing import Dict, List
+
+from websockets.client import WebSocketClientProtocol
+from websockets.framing import DATA_OPCODES
+
+
+# -------------------------------------------------------------------------
+# UTILS
+
+def format_size(nb_bytes: int) -> str:
+    if nb_bytes < 1024:
+        return "{}B".format(nb_bytes)
+    if nb_bytes < 1024 * 1024:
+        return "{:.1f}KiB".format(nb_bytes / 1024)
+    return "{:.1f}MiB".format(nb_bytes / 1024 / 1024)
+
+
+# -------------------------------------------------------------------------
+# COUNTERS
+
+class OperationTraffic:
+    __slots__ = ('count', 'sent_raw', 'sent_wire', 'received_raw', 'received_wire')
+
+    def __init__(self):
+        self.count = 0
+        self.sent_raw = 0
+        self.sent_wire = 0
+        self.received_raw = 0
+        self.received_wire = 0
+
+
+class TrafficCounters:
+    """bytes exchanged with the API, per operation
+
+    Operations are named after their root field (e.g. `sendAction`), messages
+    that don't belong to any of them (connection init, keepalives...) are
+    counted under `CONNECTION`.
+    `raw` counts are the sizes of the messages, `wire` ones the sizes of their
+    payloads once compressed (same as `raw` when compression is off).
+    """
+
+    CONNECTION = '(connection)'
+
+    def __init__(self):
+        self.operations: Dict[str, OperationTraffic] = {}
+
+    def get(self, name: str) -> OperationTraffic:
+        traffic = self.operations.get(name)
+        if traffic is None:
+            traffic = self.operations[name] = OperationTraffic()
+        return traffic
+
+    def record_sent(self, name: str, raw: int, wire: int, new_operation: bool = False):
+        traffic = self.get(name)
+        if new_operation:
+            traffic.count += 1
+        traffic.sent_raw += raw
+        traffic.sent_wire += wire
+
+    def record_received(self, name: str, raw: int, wire: int):
+        traffic = self.get(name)
+        traffic.received_raw += raw
+        traffic.received_wire += wire
+
+    def report(self) -> List[str]:
+        lines = []
+        for name, t in sorted(self.operations.items()):
+            lines.append("{} (x{}): sent {} ({} on wire), received {} ({} on wire)".format(
+                name, t.count, format_size(t.sent_raw), format_size(t.sent_wire),
+                format_size(t.received_raw), format_size(t.received_wire)))
+        return lines
+
+
+# -------------------------------------------------------------------------
+# FRAME METERING
+
+class FrameMeter:
+    """pass-through websocket extension recording the size of data frames
+
+    Extensions encode frames in list order and decode them in reverse order, so
+    one placed first sees uncompressed payloads and one placed last sees them
+    as they go on the wire.
+    """
+
+    name = 'x-frame-meter'
+
+    def __init__(self):
+        self._sending = 0
+        self._receiving = 0
+        self.sent_messages = deque()
+        self.received_messages = deque()
+
+    def decode(self, frame, *, max_size=None):
+        if frame.opcode in DATA_OPCODES:
+            self._receiving += len(frame.data)
+            if frame.fin:
+                self.received_messages.append(self._receiving)
+                self._receiving = 0
+        return frame
+
+    def encode(self, frame):
+        if frame.opcode in DATA_OPCODES:
+            self._sending += len(frame.data)
+            if frame.fin:
+                self.sent_messages.append(self._sending)
+                self._sending = 0
+        return frame
+
+
+class MeteredClientProtocol(WebSocketClientProtocol):
+    """client protocol measuring each message both uncompressed and on the wire"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.raw_meter = FrameMeter()
+        self.wire_meter = FrameMeter()
+
+    async def handshake(self, *args, **kwargs):
+        await super().handshake(*args, **kwargs)
+        self.extensions = [self.raw_meter] + self.extensions + [self.wire_meter]
+
+    def pop_sent_sizes(self):
+        """(raw, wire) sizes of the oldest sent message not popped yet"""
+        return self.raw_meter.sent_messages.popleft(), self.wire_meter.sent_messages.popleft()
+
+    def pop_received_sizes(self):
+        """(raw, wire) sizes of the oldest received message not popped yet"""
+        return self.raw_meter.received_messages.popleft(), self.wire_meter.received_messages.popleft()
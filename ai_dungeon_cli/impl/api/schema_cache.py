@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+from gql import Client
+from graphql import build_client_schema
+
+from impl.utils.debug_print import debug_print
+from impl.utils.paths import cache_dir
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: bump when the format of the cache file changes
+SCHEMA_CACHE_VERSION = 2
+
+SCHEMA_MAX_AGE = 24 * 60 * 60
+
+SCHEMA_REFRESH_TIMEOUT = 30
+
+
+# -------------------------------------------------------------------------
+# FNS: PATHS
+
+def schema_cache_path() -> str:
+    return os.path.join(cache_dir(), "schema.json")
+
+
+# -------------------------------------------------------------------------
+# SCHEMA CACHE
+
+class SchemaCache:
+    """introspected API schema, stored on disk and refreshed in the background
+
+    The cached schema is only trusted if it has the current `SCHEMA_CACHE_VERSION`
+    and was fetched from the same url by a client with the same `stamp` (which
+    should change along with its operations). It gets refreshed once older than
+    `SCHEMA_MAX_AGE`, the new version being used as soon as it is available.
+    """
+
+    def __init__(self, url: str, path: str = None, stamp: str = ''):
+        self.url = url
+        self.path = path or schema_cache_path()
+        self.stamp = stamp
+        self.schema = None
+        self.fetched_at: float = 0
+        # NB: whether the schema got fetched during this run
+        self.refreshed: bool = False
+        self._refresh_thread: threading.Thread = None
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                cached = json.load(f)
+            if cached.get("version") != SCHEMA_CACHE_VERSION or cached.get("url") != self.url \
+               or cached.get("stamp") != self.stamp:
+                return
+            self.schema = build_client_schema(cached["introspection"])
+            self.fetched_at = cached["fetched_at"]
+        except Exception as e:
+            # NB: missing, corrupted or incompatible, refreshing will overwrite it
+            debug_print("could not load cached schema: {}".format(e))
+
+    def is_stale(self) -> bool:
+        return self.schema is None or time.time() - self.fetched_at > SCHEMA_MAX_AGE
+
+    def refresh_in_background(self, make_transport):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh, args=(make_transport,),
+                                                name="schema-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def refresh(self, make_transport) -> bool:
+        """refresh right away (or wait for the refresh in progress), True if it succeeded"""
+        self.refresh_in_background(make_transport)
+        self._refresh_thread.join(SCHEMA_REFRESH_TIMEOUT)
+        return self.refreshed
+
+    def _refresh(self, make_transport):
+        async def fetch():
+            client = Client(transport=make_transport())
+            async with client as session:
+                await session.fetch_schema()
+            return client.introspection
+
+        loop = asyncio.new_event_loop()
+        try:
+            introspection = loop.run_until_complete(fetch())
+            self.save(introspection)
+            self.schema = build_client_schema(introspection)
+            self.refreshed = True
+        except Exception as e:
+            debug_print("could not refresh cached schema: {}".format(e))
+        finally:
+            loop.close()
+
+    def save(self, introspection):
+        self.fetched_at = time.time()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": SCHEMA_CACHE_VERSION,
+                "url": self.url,
+                "stamp": self.stamp,
+                "fetched_at": self.fetched_at,
+                "introspection": introspection,
+            }, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from collections import deque
+from time import monotonic
+
+from gql import gql
+
+from impl.utils.debug_print import debug_print
+from impl.utils.profiling import profiled
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+PING_QUERY = gql('{  __typename}')
+
+
+# -------------------------------------------------------------------------
+# CONNECTION SUPERVISOR
+
+class ConnectionSupervisor:
+    """keeps a single API session open for the whole game
+
+    The session lives in an event loop running in a background thread, so that
+    it stays looked after while the main thread is blocked waiting for user
+    input: when idle for `ping_interval` seconds, a trivial query is sent to
+    keep intermediaries from closing the connection and to measure the round
+    trip latency. A connection found dead gets replaced (and so re-authenticated)
+    right away instead of at the next action.
+
+    `make_client` should return a new, not yet connected, gql `Client`.
+    """
+
+    def __init__(self, make_client, ping_interval: float = 30, ping_timeout: float = 10):
+        self.make_client = make_client
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+
+        self.client = None
+        self.session = None
+        self.last_activity: float = monotonic()
+        self.in_flight: int = 0
+        self.latencies = deque(maxlen=100)
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        name="connection-supervisor", daemon=True)
+        self._thread.start()
+        self._lock: asyncio.Lock = self.run(self._make_lock())
+        self._keepalive_task = asyncio.run_coroutine_threadsafe(self._keepalive(), self.loop)
+
+    # ---------------------------------------------------------------------
+    # API (called from the main thread)
+
+    def run(self, coro):
+        """run `coro` in the supervisor's event loop, blocking until done"""
+        with profiled("network"):
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def execute(self, document, variable_values=None):
+        return self.run(self.execute_async(document, variable_values))
+
+    def reconnect_in_background(self):
+        """replace the connection, e.g. after `make_client` changed credentials"""
+        asyncio.run_coroutine_threadsafe(self._reconnect(), self.loop)
+
+    def close(self):
+        self._keepalive_task.cancel()
+        try:
+            self.run(self._close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+
+    # ---------------------------------------------------------------------
+    # COROUTINES
+
+    async def _make_lock(self):
+        # NB: on python < 3.10, must be created from inside the loop
+        return asyncio.Lock()
+
+    async def get_session(self):
+        async with self._lock:
+            if self.session is None or self.client.transport.websocket is None:
+                await self._connect()
+            return self.session
+
+    async def execute_async(self, document, variable_values=None):
+        """execute `document`, accounted as in flight (no keepalive ping meanwhile)"""
+        session = await self.get_session()
+        self.in_flight += 1
+        try:
+            return await session.execute(document, variable_values=variable_values)
+        finally:
+            self.in_flight -= 1
+            self.last_activity = monotonic()
+
+    async def _connect(self):
+        await self._disconnect()
+        debug_print("connecting to API")
+        client = self.make_client()
+        self.session = await client.__aenter__()
+        self.client = client
+
+    async def _disconnect(self):
+        client = self.client
+        self.client = None
+        self.session = None
+        if client is not None:
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception as e:
+                debug_print("error while closing connection: {}".format(e))
+
+    async def _close(self):
+        # NB: waits for a reconnection in progress (e.g. after login), which
+        # would otherwise be left pending with its connection open
+        async with self._lock:
+            await self._disconnect()
+
+    async def _reconnect(self):
+        try:
+            async with self._lock:
+                await self._connect()
+        except Exception as e:
+            # NB: will get retried at next ping or action
+            debug_print("reconnection failed: {}".format(e))
+
+    async def _ping(self):
+        session = self.session
+        if session is None or self.in_flight:
+            # NB: not connected (the next action will), or an action is already in progress
+            return
+        start = monotonic()
+        try:
+            await asyncio.wait_for(session.execute(PING_QUERY), self.ping_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            debug_print("ping failed ({}), reconnecting".format(e))
+            await self._reconnect()
+            return
+        latency = monotonic() - start
+        self.latencies.append(latency)
+        debug_print("ping: {:.0f}ms".format(latency * 1000))
+
+    async def _keepalive(self):
+        while True:
+            idle_for = monotonic() - self.last_activity
+            if idle_for < self.ping_interval:
+                await asyncio.sleep(self.ping_interval - idle_for)
+                continue
+            await self._ping()
+            self.last_activity = monotonic()
@@ -0,0 +1,105 @@
+from collections import deque
+
+from gql import WebsocketsTransport
+from graphql import ExecutionResult
+
+from impl.api.codec import get_codec
+from impl.api.metering import TrafficCounters, MeteredClientProtocol
+from impl.utils.profiling import profiled
+
+
+# -------------------------------------------------------------------------
+# UTILS
+
+def root_field_name(document) -> str:
+    """name of the root field of the first operation of `document`, e.g. `sendAction`"""
+    for definition in document.definitions:
+        selection_set = getattr(definition, "selection_set", None)
+        if selection_set and selection_set.selections:
+            return selection_set.selections[0].name.value
+    return TrafficCounters.CONNECTION
+
+
+# -------------------------------------------------------------------------
+# TRANSPORT
+
+class CodecWebsocketsTransport(WebsocketsTransport):
+    """`WebsocketsTransport` decoding query results with a pluggable JSON codec
+
+    Only 'data' answers (the ones growing with the adventure) take the fast
+    path, other kinds of answers are left to the parent implementation.
+
+    When given `traffic` counters, the size of each message gets recorded,
+    uncompressed and on the wire, under the name of its operation.
+    """
+
+    def __init__(self, *args, codec=None, traffic: TrafficCounters = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = codec or get_codec()
+        self.traffic = traffic
+        if traffic is not None:
+            self.connect_args = dict(self.connect_args, create_protocol=MeteredClientProtocol)
+        # query id -> operation name
+        self.operation_names = {}
+        self._next_sent_operation: str = None
+        self._sending = deque()
+        self._received_sizes = None
+
+    async def _send_query(self, document, variable_values=None, operation_name=None):
+        if self.traffic is not None:
+            name = root_field_name(document)
+            self.operation_names[self.next_query_id] = name
+            self._next_sent_operation = name
+        return await super()._send_query(document, variable_values, operation_name)
+
+    async def _send(self, message: str):
+        if self.traffic is None:
+            return await super()._send(message)
+
+        name = self._next_sent_operation
+        self._next_sent_operation = None
+        # NB: messages get sent (and so metered) in the order of calls, whichever
+        # coroutine gets to pop first
+        self._sending.append(name)
+        await super()._send(message)
+        name = self._sending.popleft()
+        raw, wire = self.websocket.pop_sent_sizes()
+        self.traffic.record_sent(name or TrafficCounters.CONNECTION, raw, wire, new_operation=name is not None)
+
+    async def _receive(self) -> str:
+        answer = await super()._receive()
+        if self.traffic is not None:
+            self._received_sizes = self.websocket.pop_received_sizes()
+        return answer
+
+    def _parse_answer(self, answer):
+        with profiled("json_decode"):
+            answer_type, answer_id, result = self._decode_answer(answer)
+        if self.traffic is not None and self._received_sizes is not None:
+            if answer_type == "complete":
+                name = self.operation_names.pop(answer_id, TrafficCounters.CONNECTION)
+            else:
+                name = self.operation_names.get(answer_id, TrafficCounters.CONNECTION)
+            self.traffic.record_received(name, *self._received_sizes)
+            self._received_sizes = None
+        return answer_type, answer_id, result
+
+    def _decode_answer(self, answer):
+        try:
+            json_answer = self.codec.loads(answer)
+        except ValueError:
+            return super()._parse_answer(answer)
+
+        if not isinstance(json_answer, dict) or json_answer.get("type") != "data":
+            return super()._parse_answer(answer)
+
+        payload = json_answer.get("payload")
+        if not isinstance(payload, dict) or ("data" not in payload and "errors" not in payload):
+            return super()._parse_answer(answer)
+
+        try:
+            answer_id = int(str(json_answer.get("id")))
+        except ValueError:
+            return super()._parse_answer(answer)
+
+        return "data", answer_id, ExecutionResult(errors=payload.get("errors"), data=payload.get("data"))
@@ -7,8 +7,20 @@ import yaml
 # -------------------------------------------------------------------------
 # UTILS: DICT
 
-def exists(cfg: Dict[str, str], key: str) -> str:
-    return key in cfg and cfg[key]
+def exists(cfg: Dict[str, str], key: str) -> bool:
+    # NB: falsy values (e.g. `slow_typing_effect: False` in a profile) are legit
+    return key in cfg and cfg[key] is not None
+
+
+# -------------------------------------------------------------------------
+# EXCEPTIONS
+
+class UnknownProfile(Exception):
+    """raise this when the selected profile is not in the config file"""
+
+
+class InvalidConfig(Exception):
+    """raise this when a value of the config file is not valid"""
 
 
 # -------------------------------------------------------------------------
@@ -18,27 +30,34 @@ class Config:
     def __init__(self):
         self.prompt: str = "> "
         self.slow_typing_effect: bool = False
+        self.io_mode: str = "term"
+
+        self.compression: str = "deflate"
+        self.max_window_bits: int = None
+        self.max_message_size: int = 2 ** 20
 
         self.auth_token: str = None
         self.email: str = None
         self.password: str = None
 
+        self.scenario: str = None
         self.character_name: str = None
         self.public_adventure_id: str = None
 
+        self.profile: str = None
+
         self.debug: bool = False
+        self.profile_output: str = None
 
     @staticmethod
     def merged(confs):
-        default_conf = Config()
+        """merge of `confs`, later ones overriding earlier ones (e.g. cli args over config file)"""
         conf = Config()
         for c in confs:
-            for a in ['prompt', 'slow_typing_effect',
-                      'auth_token', 'email', 'password',
-                      'character_name', 'public_adventure_id',
-                      'debug']:
-                v = getattr(c, a)
-                if getattr(default_conf, a) != v:
+            for a, v in vars(c).items():
+                # NB: None stands for unset (e.g. `--slow-typing` not given), so
+                # cli args have no defaults of their own
+                if v is not None:
                     setattr(conf, a, v)
         return conf
 
@@ -54,26 +73,51 @@ class Config:
             self.prompt = parsed.prompt
         if hasattr(parsed, "slow_typing"):
             self.slow_typing_effect = parsed.slow_typing
+        if hasattr(parsed, "io_mode"):
+            self.io_mode = parsed.io_mode
+        if hasattr(parsed, "compression"):
+            self.compression = parsed.compression
+        if hasattr(parsed, "max_window_bits"):
+            self.max_window_bits = parsed.max_window_bits
+        if hasattr(parsed, "max_message_size"):
+            self.max_message_size = parsed.max_message_size
         if hasattr(parsed, "auth_token"):
             self.auth_token = parsed.auth_token
         if hasattr(parsed, "email"):
             self.email = parsed.email
         if hasattr(parsed, "password"):
             self.password = parsed.password
+        if hasattr(parsed, "scenario"):
+            self.scenario = parsed.scenario
         if hasattr(parsed, "adventure"):
             self.public_adventure_id = parsed.adventure
         if hasattr(parsed, "name"):
             self.character_name = parsed.name
+        if hasattr(parsed, "profile"):
+            self.profile = parsed.profile
         if hasattr(parsed, "debug"):
             self.debug = parsed.debug
+        if hasattr(parsed, "profile_output"):
+            self.profile_output = parsed.profile_output
 
     @staticmethod
     def parse_cli_args():
         parser = argparse.ArgumentParser(description='ai-dungeon-cli is a command-line client to play.aidungeon.io')
-        parser.add_argument("--prompt", type=str, required=False, default="> ",
+        parser.add_argument("--prompt", type=str, required=False,
                             help="text for user prompt")
         parser.add_argument("--slow-typing", action='store_const', const=True,
                             help="enable slow typing effect for story")
+        parser.add_argument("--io-mode", type=str, required=False,
+                            choices=["term", "json"],
+                            help="'json' to read inputs and write events as JSON lines, for use by other programs")
+
+        parser.add_argument("--compression", type=str, required=False,
+                            choices=["deflate", "off"],
+                            help="websocket compression to negotiate with the API")
+        parser.add_argument("--max-window-bits", type=int, required=False, choices=range(9, 16), metavar="{9..15}",
+                            help="compression window size, lower values use less memory but compress less")
+        parser.add_argument("--max-message-size", type=int, required=False,
+                            help="largest message accepted from the API, in bytes (uncompressed), 0 for no limit")
 
         parser.add_argument("--auth-token", type=str, required=False,
                             help="authentication token")
@@ -82,52 +126,160 @@ class Config:
         parser.add_argument("--password", type=str, required=False,
                             help="password (for authentication)")
 
+        parser.add_argument("--scenario", type=str, required=False,
+                            help="scenario to start, skipping menus, e.g. 'fantasy/knight' (partial or approximate names work)")
+
         parser.add_argument("--adventure", type=str, required=False,
                             help="public multi-user adventure id to connect to")
         parser.add_argument("--name", type=str, required=False,
-                            help="character name for multi-user adventure")
+                            help="character name (required for multi-user adventure, otherwise skips being asked for it)")
+
+        parser.add_argument("--profile", type=str, required=False,
+                            help="name of the profile (from the config file) to use")
 
         parser.add_argument("--debug", action='store_const', const=True,
                             help="enable debug")
+        parser.add_argument("--profile-output", type=str, required=False, metavar="PREFIX",
+                            help="profile the session, writing reports to PREFIX.pstats, PREFIX.folded and PREFIX.turns.csv on exit")
 
         parsed = parser.parse_args()
 
+        if parsed.max_message_size is not None and parsed.max_message_size < 0:
+            parser.error("--max-message-size can't be negative (0 for no limit)")
+
         if parsed.adventure and not parsed.name:
             parser.error("--name needs to be provided when joining a multi-user adventure (--adventure argument)")
 
         return parsed
 
     @staticmethod
-    def loaded_from_file():
+    def loaded_from_file(profile: str = None):
         conf = Config()
-        conf.load_from_file()
+        conf.load_from_file(profile)
         return conf
 
-    def load_from_file(self):
-        cfg_file = "/config.yml"
-        cfg_file_paths = [
-            os.path.dirname(os.path.realpath(__file__)) + cfg_file,
-            os.path.expanduser("~") + "/.config/ai-dungeon-cli" + cfg_file,
-        ]
-
-        did_read_cfg_file = False
-
-        cfg = {}
-        for file in cfg_file_paths:
-            try:
-                with open(file, "r") as cfg_raw:
-                    cfg = yaml.load(cfg_raw, Loader=yaml.FullLoader)
-                    did_read_cfg_file = True
-            except IOError:
-                pass
-
-        if exists(cfg, "prompt"):
-            self.prompt = cfg["prompt"]
-        if exists(cfg, "slow_typing_effect"):
-            self.slow_typing_effect = cfg["slow_typing_effect"]
-        if exists(cfg, "auth_token"):
-            self.auth_token = cfg["auth_token"]
-        if exists(cfg, "email"):
-            self.email = cfg["email"]
-        if exists(cfg, "password"):
-            self.password = cfg["password"]
+    def load_from_file(self, profile: str = None):
+        cfg = read_cfg_file()
+        self.load_from_dict(cfg)
+        if profile:
+            profiles = cfg.get("profiles") or {}
+            if profile not in profiles:
+                raise UnknownProfile("No profile '{}' in config file".format(profile))
+            self.load_from_dict(profiles[profile] or {})
+
+    def load_from_dict(self, cfg: Dict[str, str]):
+        for key, attr in CFG_FILE_KEYS.items():
+            if exists(cfg, key):
+                value = cfg[key]
+                if key in CFG_FILE_PARSERS:
+                    try:
+                        value = CFG_FILE_PARSERS[key](value)
+                    except ValueError as e:
+                        raise InvalidConfig("Invalid '{}' in config file: {}".format(key, e))
+                setattr(self, attr, value)
+
+    @staticmethod
+    def profiles_loaded_from_file() -> Dict[str, 'Config']:
+        """all the profiles of the config file, e.g. to run several sessions concurrently"""
+        cfg = read_cfg_file()
+        profiles = {}
+        for profile in (cfg.get("profiles") or {}):
+            conf = Config()
+            conf.load_from_file(profile)
+            conf.profile = profile
+            profiles[profile] = conf
+        return profiles
+
+
+# -------------------------------------------------------------------------
+# CONF FILE
+
+# config file key -> Config attribute
+CFG_FILE_KEYS = {
+    "prompt": "prompt",
+    "slow_typing_effect": "slow_typing_effect",
+    "io_mode": "io_mode",
+    "compression": "compression",
+    "max_window_bits": "max_window_bits",
+    "max_message_size": "max_message_size",
+    "auth_token": "auth_token",
+    "email": "email",
+    "password": "password",
+    "scenario": "scenario",
+    "character_name": "character_name",
+}
+
+def parse_compression(value) -> str:
+    # NB: YAML reads an unquoted `off` as False (and `on` as True)
+    if value is False:
+        return "off"
+    if value is True:
+        return "deflate"
+    if value not in ["deflate", "off"]:
+        raise ValueError("should be 'deflate' or 'off', not {!r}".format(value))
+    return value
+
+
+def parse_max_window_bits(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or not 9 <= value <= 15:
+        raise ValueError("should be an integer from 9 to 15, not {!r}".format(value))
+    return value
+
+
+def parse_max_message_size(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("should be a number of bytes (0 for no limit), not {!r}".format(value))
+    return value
+
+
+# config file key -> function normalizing its value, raising ValueError if invalid
+CFG_FILE_PARSERS = {
+    "compression": parse_compression,
+    "max_window_bits": parse_max_window_bits,
+    "max_message_size": parse_max_message_size,
+}
+
+# NB: the C implementation is only there if PyYAML was built against libyaml
+YamlLoader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# path -> (mtime, size, parsed content)
+_parsed_cfg_files = {}
+
+
+def cfg_file_paths():
+    cfg_file = "/config.yml"
+    return [
+        os.path.dirname(os.path.realpath(__file__)) + cfg_file,
+        os.path.expanduser("~") + "/.config/ai-dungeon-cli" + cfg_file,
+    ]
+
+
+def parse_cfg_file(path: str):
+    """content of config file at `path`, only re-parsed when it changed
+
+    Returns None if there is no such file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    snapshot = _parsed_cfg_files.get(path)
+    if snapshot is not None and snapshot[0] == stat.st_mtime_ns and snapshot[1] == stat.st_size:
+        return snapshot[2]
+    try:
+        with open(path, "r") as cfg_raw:
+            cfg = yaml.load(cfg_raw, Loader=YamlLoader) or {}
+    except IOError:
+        return None
+    _parsed_cfg_files[path] = (stat.st_mtime_ns, stat.st_size, cfg)
+    return cfg
+
+
+def read_cfg_file():
+    # NB: last file found wins
+    cfg = {}
+    for path in cfg_file_paths():
+        parsed = parse_cfg_file(path)
+        if parsed is not None:
+            cfg = parsed
+    return cfg
@@ -0,0 +1,304 @@
+import gc
+import os
+import copy
+import csv
+import random
+import threading
+import tracemalloc
+from time import monotonic
+from typing import Dict, List
+
+from impl.api.client import AiDungeonApiClient
+from impl.conf import Config
+from impl.user_interaction import UserIo
+from impl.loadtest.server import StandInServer
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: the only one of the stand-in server (never resolved through the scenario
+# catalog, which would then cache it as if it came from a real server)
+STAND_IN_SCENARIO_ID = "scenario:loadtest"
+
+ACTIONS = ["look around", "open the door", "/say Hello there!", "draw my sword",
+           "walk to the tavern", "/story The wind rises.", "ask about the dragon"]
+
+
+# -------------------------------------------------------------------------
+# UTILS
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0
+    i = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def count_open_fds() -> int:
+    for fd_dir in ["/proc/self/fd", "/dev/fd"]:
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return -1
+
+
+# -------------------------------------------------------------------------
+# STATS
+
+class LoadStats:
+    """thread-safe accumulator of the timings reported by simulated players"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings: Dict[str, List[float]] = {}
+        self.turns = 0
+        self.errors = 0
+        self.sessions = 0
+
+    def record_timing(self, name: str, seconds: float):
+        with self._lock:
+            self.timings.setdefault(name, []).append(seconds)
+            if name == "regular_action":
+                self.turns += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def record_session(self):
+        with self._lock:
+            self.sessions += 1
+
+    def pop_timings(self) -> Dict[str, List[float]]:
+        with self._lock:
+            timings = self.timings
+            self.timings = {}
+            return timings
+
+
+# -------------------------------------------------------------------------
+# SIMULATED PLAYER
+
+class ScriptedIo(UserIo):
+    """discards all output, only keeping timing samples"""
+
+    def __init__(self, stats: LoadStats):
+        self.stats = stats
+
+    def handle_timing(self, name: str, seconds: float):
+        self.stats.record_timing(name, seconds)
+
+
+class SimulatedPlayer(threading.Thread):
+    """plays sessions of `turns_per_session` turns in a row, until stopped
+
+    Each session goes through a new API client (and so a new connection and
+    login), to exercise their setup and teardown. Against a real server
+    (`stand_in` False), sessions start the scenario of `conf`.
+    """
+
+    # NB: the first player to resolve a scenario crawls (and caches) the catalog,
+    # the others wait for it to load it
+    scenario_lock = threading.Lock()
+
+    def __init__(self, player_id: int, game_class, conf: Config, url: str, stats: LoadStats,
+                 stop_event: threading.Event, think_time: float, turns_per_session: int, on_session_end=None,
+                 stand_in: bool = True):
+        super().__init__(name="player-{}".format(player_id), daemon=True)
+        self.game_class = game_class
+        self.conf = copy.copy(conf)
+        self.conf.character_name = conf.character_name or self.name
+        self.url = url
+        self.stand_in = stand_in
+        self.stats = stats
+        self.stop_event = stop_event
+        self.think_time = think_time
+        self.turns_per_session = turns_per_session
+        self.on_session_end = on_session_end
+
+    def run(self):
+        while not self.stop_event.is_set():
+            api = AiDungeonApiClient(url=self.url, use_schema_cache=False,
+                                     compression=self.conf.compression,
+                                     max_window_bits=self.conf.max_window_bits,
+                                     max_message_size=self.conf.max_message_size)
+            game = self.game_class(api, self.conf, ScriptedIo(self.stats))
+            try:
+                self.play_session(api, game)
+            except Exception:
+                self.stats.record_error()
+                # NB: avoid hammering a failing server
+                self.stop_event.wait(1)
+            finally:
+                api.close()
+                if self.on_session_end and game.adventure_id:
+                    self.on_session_end(game.adventure_id)
+            self.stats.record_session()
+
+    def play_session(self, api: AiDungeonApiClient, game):
+        game.login()
+        if self.stand_in:
+            game.scenario_id = STAND_IN_SCENARIO_ID
+            game.setting_name = "loadtest"
+            game.character_name = self.conf.character_name
+            template = api.get_story_template_for_scenario(game.scenario_id)
+            game.story_pitch = api.make_story_pitch(template, game.character_name)
+        else:
+            with SimulatedPlayer.scenario_lock:
+                game.choose_config_from_scenario_path(self.conf.scenario)
+        game.init_story()
+        for _ in range(self.turns_per_session):
+            if self.stop_event.wait(random.uniform(0, 2 * self.think_time)):
+                return
+            game.process_regular_action(random.choice(ACTIONS))
+
+
+# -------------------------------------------------------------------------
+# LOAD TEST
+
+class LoadTest:
+    """runs simulated players against a server for a given duration
+
+    Players are added `ramp_step` at a time every `ramp_interval` seconds, up
+    to `max_players`. Every `report_interval` seconds, latency percentiles,
+    throughput, traced memory, open file descriptors and threads get sampled.
+    A leak report compares the first sample taken at full load with the last.
+    When no `url` is given, a `StandInServer` is started in-process. Otherwise,
+    players start the `scenario` of their config, which must be set.
+
+    `game_class` is the game logic class (e.g. `AiDungeonGame`) to drive.
+    Players are given the `configs` in turn (e.g. profiles from the config file,
+    for their credentials and network settings), a default `Config` otherwise.
+    """
+
+    def __init__(self, game_class, max_players: int = 10, ramp_step: int = 1, ramp_interval: float = 10,
+                 duration: float = 3600, report_interval: float = 30,
+                 think_time: float = 2, turns_per_session: int = 20,
+                 server_latency: float = 0.5, url: str = None, output: str = None,
+                 configs: List[Config] = None):
+        self.game_class = game_class
+        self.configs = configs or [Config()]
+        self.max_players = max_players
+        self.ramp_step = ramp_step
+        self.ramp_interval = ramp_interval
+        self.duration = duration
+        self.report_interval = report_interval
+        self.think_time = think_time
+        self.turns_per_session = turns_per_session
+        self.server_latency = server_latency
+        self.url = url
+        self.output = output
+
+        self.stats = LoadStats()
+        self.stop_event = threading.Event()
+        self.players: List[SimulatedPlayer] = []
+        self.samples: List[Dict] = []
+
+    def run(self):
+        initial_fds, initial_threads = count_open_fds(), threading.active_count()
+        tracemalloc.start()
+        server = None
+        if not self.url:
+            server = StandInServer(latency=self.server_latency, jitter=self.server_latency / 2)
+            server.start()
+            self.url = server.url
+        on_session_end = server.forget_adventure if server else None
+
+        start = monotonic()
+        next_ramp = start
+        next_report = start + self.report_interval
+        baseline = None
+        try:
+            while monotonic() - start < self.duration:
+                now = monotonic()
+                if now >= next_ramp and len(self.players) < self.max_players:
+                    for _ in range(min(self.ramp_step, self.max_players - len(self.players))):
+                        conf = self.configs[len(self.players) % len(self.configs)]
+                        player = SimulatedPlayer(len(self.players) + 1, self.game_class, conf, self.url,
+                                                 self.stats, self.stop_event,
+                                                 self.think_time, self.turns_per_session, on_session_end,
+                                                 stand_in=server is not None)
+                        player.start()
+                        self.players.append(player)
+                    next_ramp = now + self.ramp_interval
+                if now >= next_report:
+                    sample = self.sample(start)
+                    next_report = now + self.report_interval
+                    if baseline is None and len(self.players) == self.max_players:
+                        baseline = (sample, self.take_snapshot())
+                self.stop_event.wait(min(1, max(0, min(next_ramp, next_report) - monotonic())))
+        except KeyboardInterrupt:
+            print("Interrupted, stopping players...")
+        finally:
+            # NB: last sample while still under load, to compare with the baseline one
+            self.sample(start)
+            last_snapshot = self.take_snapshot()
+            self.stop_event.set()
+            for player in self.players:
+                player.join()
+            if server:
+                server.stop()
+            tracemalloc.stop()
+
+        if baseline is not None:
+            self.print_leak_report(*baseline, last_snapshot)
+        print("After shutdown: open_fds {} (was {} before start), threads {} (was {})".format(
+            count_open_fds(), initial_fds, threading.active_count(), initial_threads))
+
+    def take_snapshot(self):
+        gc.collect()
+        return tracemalloc.take_snapshot()
+
+    def sample(self, start: float) -> Dict:
+        # NB: otherwise garbage not collected yet (e.g. closed connections, which
+        # have reference cycles) shows up as leaked memory
+        gc.collect()
+        now = monotonic()
+        since = self.samples[-1]["elapsed_s"] if self.samples else 0
+        turns = self.stats.turns
+        new_turns = turns - (self.samples[-1]["turns"] if self.samples else 0)
+        latencies = sorted(self.stats.pop_timings().get("regular_action", []))
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        sample = {
+            "elapsed_s": round(now - start, 1),
+            "players": len(self.players),
+            "turns": turns,
+            "turns_per_s": round(new_turns / max(now - start - since, 0.001), 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round((latencies[-1] if latencies else 0) * 1000, 1),
+            "sessions": self.stats.sessions,
+            "errors": self.stats.errors,
+            "traced_kb": traced_current // 1024,
+            "traced_peak_kb": traced_peak // 1024,
+            "open_fds": count_open_fds(),
+            "threads": threading.active_count(),
+        }
+        self.samples.append(sample)
+        self.write_sample(sample)
+        return sample
+
+    def write_sample(self, sample: Dict):
+        if len(self.samples) == 1:
+            print(' '.join("{:>14}".format(k) for k in sample))
+        print(' '.join("{:>14}".format(v) for v in sample.values()))
+        if self.output:
+            is_new = len(self.samples) == 1
+            with open(self.output, "a", newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(sample))
+                if is_new:
+                    writer.writeheader()
+                writer.writerow(sample)
+
+    def print_leak_report(self, baseline: Dict, baseline_snapshot, last_snapshot, top: int = 10):
+        last = self.samples[-1]
+        hours = max(last["elapsed_s"] - baseline["elapsed_s"], 1) / 3600
+        print()
+        print("Growth under load since {}s:".format(baseline["elapsed_s"]))
+        for key in ["traced_kb", "open_fds", "threads"]:
+            delta = last[key] - baseline[key]
+            print("  {}: {} -> {} ({:+.1f}/h)".format(key, baseline[key], last[key], delta / hours))
+        print("Top allocation growth:")
+        for stat in last_snapshot.compare_to(baseline_snapshot, "lineno")[:top]:
+            print("  {}".format(stat))
@@ -0,0 +1,232 @@
+import json
+import random
+import asyncio
+import threading
+from itertools import count
+
+import websockets
+from graphql import parse
+
+from impl.utils.debug_print import debug_print
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+WORDS = ("the a you dragon knight castle sword forest river goblin wizard tavern "
+         "king queen walk see dark light door open strange voice cold").split()
+
+STORY_TEMPLATE = "You are ${character.name}, a knight living in the kingdom of Larion."
+
+# scenario id -> (prompt, [(option id, option title)]), other ids being playable scenarios
+SCENARIOS = {
+    "scenario:458612": ("Pick a setting...", [("scenario:fantasy", "fantasy"),
+                                             ("scenario:mystery", "mystery")]),
+    "scenario:fantasy": ("Pick a character...", [("scenario:fantasy:knight", "knight"),
+                                                ("scenario:fantasy:wizard", "wizard")]),
+    "scenario:mystery": ("Pick a character...", [("scenario:mystery:detective", "detective")]),
+}
+
+
+# -------------------------------------------------------------------------
+# UTILS
+
+def project(value, selection_set):
+    """keep only the fields of `value` asked for by `selection_set`, recursively
+
+    Resolvers return every field they know of, so that answers only weigh what
+    the client actually asks for, as with the real API. Fragments are not
+    supported (the client doesn't use any).
+    """
+    if selection_set is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, selection_set) for item in value]
+    projected = {}
+    for field in selection_set.selections:
+        key = field.alias.value if field.alias else field.name.value
+        projected[key] = project(value.get(field.name.value), field.selection_set)
+    return projected
+
+
+# -------------------------------------------------------------------------
+# STAND-IN SERVER
+
+class StandInServer:
+    """local stand-in for the AI Dungeon API, speaking the graphql-ws protocol
+
+    Answers the operations of `AiDungeonApiClient` with made-up but plausible
+    data projected onto the fields they ask for, after `latency` seconds
+    (+/- `jitter`) for story generation. Runs its own event loop in a background
+    thread.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.5, jitter: float = 0.25, words_per_action: int = 60):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.words_per_action = words_per_action
+
+        self.adventures = {}
+        self._ids = count(1)
+
+        self.loop = asyncio.new_event_loop()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return "ws://{}:{}/subscriptions".format(self.host, self.port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.loop.run_forever, name="stand-in-server", daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _serve(self):
+        return await websockets.serve(self._handle_connection, self.host, self.port,
+                                      subprotocols=["graphql-ws"])
+
+    # ---------------------------------------------------------------------
+    # PROTOCOL
+
+    async def _handle_connection(self, websocket, path=None):
+        tasks = set()
+        try:
+            async for message in websocket:
+                message = json.loads(message)
+                message_type = message.get("type")
+                if message_type == "connection_init":
+                    await websocket.send(json.dumps({"type": "connection_ack"}))
+                elif message_type == "start":
+                    task = asyncio.ensure_future(self._handle_operation(websocket, message))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif message_type == "connection_terminate":
+                    break
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _handle_operation(self, websocket, message):
+        query_id = message["id"]
+        payload = message["payload"]
+        try:
+            data = await self._resolve(payload["query"], payload.get("variables") or {})
+            answer = {"type": "data", "id": query_id, "payload": {"data": data}}
+        except Exception as e:
+            debug_print("stand-in server error: {}".format(e))
+            answer = {"type": "data", "id": query_id, "payload": {"errors": [{"message": str(e)}]}}
+        try:
+            await websocket.send(json.dumps(answer))
+            await websocket.send(json.dumps({"type": "complete", "id": query_id}))
+        except websockets.ConnectionClosed:
+            pass
+
+    # ---------------------------------------------------------------------
+    # RESOLVERS
+
+    async def _resolve(self, query: str, variables):
+        operation = parse(query).definitions[0]
+        data = {}
+        for field in operation.selection_set.selections:
+            name = field.name.value
+            key = field.alias.value if field.alias else name
+            value = await getattr(self, "_resolve_" + name)(variables)
+            data[key] = project(value, field.selection_set)
+        return data
+
+    async def _resolve___typename(self, variables):
+        return "Query"
+
+    async def _resolve_login(self, variables):
+        return await self._resolve_createAnonymousAccount(variables)
+
+    async def _resolve_createAnonymousAccount(self, variables):
+        user_id = next(self._ids)
+        return {"id": "user:{}".format(user_id), "accessToken": "token-{}".format(user_id)}
+
+    async def _resolve_content(self, variables):
+        # NB: public ids of adventures are the same as their ids
+        content_id = variables.get("id") or variables.get("playPublicId")
+        adventure = self.adventures.get(content_id)
+        prompt, options = SCENARIOS.get(content_id, (STORY_TEMPLATE, None))
+        return {
+            "id": content_id,
+            "prompt": prompt,
+            "options": [{"id": i, "title": t, "__typename": "Scenario"} for i, t in options] if options else None,
+            "actions": adventure or [],
+            "quests": "",
+            "playPublicId": content_id,
+            "__typename": "Adventure",
+        }
+
+    async def _resolve_createAdventureFromScenarioId(self, variables):
+        adventure_id = "adventure:{}".format(next(self._ids))
+        self.adventures[adventure_id] = []
+        history_list = []
+        if variables.get("prompt"):
+            await self._generation_delay()
+            history_list = [{"type": "story", "text": variables["prompt"]},
+                            {"type": "continue", "text": self._make_text()}]
+            self._add_action(adventure_id, ''.join(e["text"] for e in history_list))
+        return {"id": adventure_id, "historyList": history_list}
+
+    async def _resolve_sendAction(self, variables):
+        action = variables["input"]
+        adventure_id = action["id"]
+        actions = self.adventures.setdefault(adventure_id, [])
+        if action["type"] == "alter":
+            altered = [a for a in actions if a["id"] == action.get("actionId")]
+            if not altered:
+                raise ValueError("no action {} in {}".format(action.get("actionId"), adventure_id))
+            altered[0]["text"] = action["text"]
+            return {"id": adventure_id, "actions": actions, "__typename": "Adventure"}
+
+        await self._generation_delay()
+        if action["type"] == "retry" and actions:
+            actions.pop()
+        self._add_action(adventure_id, "\n> " + action.get("text", "") + "\n" + self._make_text())
+        return {"id": adventure_id, "actions": actions, "__typename": "Adventure"}
+
+    async def _resolve_updateMemory(self, variables):
+        return {"id": variables["input"]["id"]}
+
+    async def _resolve_addUserToAdventure(self, variables):
+        return variables["adventurePlayPublicId"]
+
+    async def _resolve_addDeviceToken(self, variables):
+        return True
+
+    async def _resolve_sendEvent(self, variables):
+        return True
+
+    # ---------------------------------------------------------------------
+    # HELPERS
+
+    def forget_adventure(self, adventure_id: str):
+        self.adventures.pop(adventure_id, None)
+
+    def _add_action(self, adventure_id: str, text: str):
+        self.adventures[adventure_id].append({
+            "id": str(next(self._ids)), "text": text, "__typename": "Action"})
+
+    def _make_text(self) -> str:
+        return ' '.join(random.choice(WORDS) for _ in range(self.words_per_action)) + '.'
+
+    async def _generation_delay(self):
+        await asyncio.sleep(max(0, self.latency + random.uniform(-self.jitter, self.jitter)))
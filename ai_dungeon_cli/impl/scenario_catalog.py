@@ -0,0 +1,215 @@
+import os
+import json
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from impl.utils.debug_print import debug_print
+from impl.utils.paths import cache_dir
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: bump when the format of the cache file changes
+CATALOG_VERSION = 1
+
+CATALOG_MAX_AGE = 7 * 24 * 60 * 60
+
+FUZZY_MIN_SCORE = 0.5
+
+
+# -------------------------------------------------------------------------
+# EXCEPTIONS
+
+class ScenarioNotFound(Exception):
+    """raise this when a scenario path resolves to no or several scenarios"""
+
+
+# -------------------------------------------------------------------------
+# UTILS: STRINGS
+
+def normalize_name(name: str) -> str:
+    return name.strip().lower().replace('/', '-')
+
+
+def normalize_path(path: str) -> str:
+    return '/'.join(normalize_name(s) for s in path.strip('/').split('/'))
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = '  ' + text + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# -------------------------------------------------------------------------
+# ENTRY
+
+class ScenarioEntry:
+    __slots__ = ('path', 'scenario_id', 'prompt')
+
+    def __init__(self, path: str, scenario_id: str, prompt: str = None):
+        self.path = path
+        self.scenario_id = scenario_id
+        self.prompt = prompt
+
+    @property
+    def setting_name(self) -> str:
+        return self.path.split('/')[0]
+
+
+# -------------------------------------------------------------------------
+# CATALOG
+
+class ScenarioCatalog:
+    """index of all the single-player scenarios, by path
+
+    Paths look like `<setting>/<character>` or `archive/<option>/.../<option>`.
+    They can be looked up exactly, by prefix of each of their parts (e.g.
+    `fan/kni`), by last part only (e.g. `knight`) or fuzzily, through trigram
+    indexes of whole paths and of their parts (so that a single-part query like
+    `knigt` is scored against `knight`, not against `fantasy/knight`).
+    """
+
+    def __init__(self, entries: List[ScenarioEntry], built_at: float = None):
+        self.built_at = built_at or time.time()
+        self.entries = sorted(entries, key=lambda e: e.path)
+        self._paths = [e.path for e in self.entries]
+        self._by_last_part: Dict[str, List[int]] = defaultdict(list)
+        self._by_trigram: Dict[str, List[int]] = defaultdict(list)
+        # trigram -> (entry index, part index)
+        self._by_part_trigram: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for i, path in enumerate(self._paths):
+            self._by_last_part[path.rsplit('/', 1)[-1]].append(i)
+            for trigram in trigrams(path):
+                self._by_trigram[trigram].append(i)
+            for j, part in enumerate(path.split('/')):
+                for trigram in trigrams(part):
+                    self._by_part_trigram[trigram].append((i, j))
+
+    # ---------------------------------------------------------------------
+    # LOOKUP
+
+    def resolve(self, query: str) -> ScenarioEntry:
+        query = normalize_path(query)
+        for lookup in [self._exact_matches, self._prefix_matches,
+                       self._last_part_matches, self._fuzzy_matches]:
+            matches = lookup(query)
+            if len(matches) == 1:
+                return self.entries[matches[0]]
+            if len(matches) > 1:
+                candidates = ', '.join(self._paths[i] for i in matches[:10])
+                raise ScenarioNotFound("Scenario '{}' is ambiguous, could be: {}".format(query, candidates))
+        raise ScenarioNotFound("No scenario matching '{}'".format(query))
+
+    def _exact_matches(self, query: str) -> List[int]:
+        i = bisect_left(self._paths, query)
+        if i < len(self._paths) and self._paths[i] == query:
+            return [i]
+        return []
+
+    def _prefix_matches(self, query: str) -> List[int]:
+        parts = query.split('/')
+        matches = []
+        # NB: candidates all share the prefix of the first part, so are contiguous
+        i = bisect_left(self._paths, parts[0])
+        while i < len(self._paths) and self._paths[i].startswith(parts[0]):
+            path_parts = self._paths[i].split('/')
+            if len(path_parts) == len(parts) \
+               and all(p.startswith(q) for p, q in zip(path_parts, parts)):
+                matches.append(i)
+            i += 1
+        return matches
+
+    def _last_part_matches(self, query: str) -> List[int]:
+        if '/' in query:
+            return []
+        return self._by_last_part.get(query, [])
+
+    def _fuzzy_matches(self, query: str) -> List[int]:
+        query_trigrams = trigrams(query)
+        scores: Dict[int, int] = defaultdict(int)
+        if '/' in query:
+            for trigram in query_trigrams:
+                for i in self._by_trigram.get(trigram, []):
+                    scores[i] += 1
+        else:
+            # NB: an entry scores as its best matching part
+            part_scores: Dict[Tuple[int, int], int] = defaultdict(int)
+            for trigram in query_trigrams:
+                for i_j in self._by_part_trigram.get(trigram, []):
+                    part_scores[i_j] += 1
+            for (i, _), score in part_scores.items():
+                scores[i] = max(scores[i], score)
+        if not scores:
+            return []
+        best = max(scores.values())
+        if best / len(query_trigrams) < FUZZY_MIN_SCORE:
+            return []
+        return sorted(i for i, score in scores.items() if score == best)
+
+    # ---------------------------------------------------------------------
+    # BUILD
+
+    @staticmethod
+    def crawled(api) -> 'ScenarioCatalog':
+        """walk the whole scenario tree, as the menus of the game would"""
+        entries = []
+        _, settings = api.get_options(api.single_player_mode_id)
+        for setting_id, setting_name in settings.values():
+            setting_name = normalize_name(setting_name)
+            if setting_name == 'custom':
+                entries.append(ScenarioEntry(setting_name, setting_id))
+            elif setting_name == 'archive':
+                ScenarioCatalog._crawl_archive(api, setting_id, setting_name, entries)
+            else:
+                _, characters = api.get_characters(setting_id)
+                for character_id, character_type in characters.values():
+                    prompt = api.get_story_template_for_scenario(character_id)
+                    path = setting_name + '/' + normalize_name(character_type)
+                    entries.append(ScenarioEntry(path, character_id, prompt))
+        return ScenarioCatalog(entries)
+
+    @staticmethod
+    def _crawl_archive(api, scenario_id: str, path: str, entries: List[ScenarioEntry]):
+        prompt, options = api.get_options(scenario_id)
+        if options is None:
+            entries.append(ScenarioEntry(path, scenario_id, prompt))
+            return
+        for option_id, option_name in options.values():
+            ScenarioCatalog._crawl_archive(api, option_id, path + '/' + normalize_name(option_name), entries)
+
+    # ---------------------------------------------------------------------
+    # PERSISTENCE
+
+    @staticmethod
+    def default_path() -> str:
+        return os.path.join(cache_dir(), "scenarios.json")
+
+    @staticmethod
+    def loaded(path: str = None) -> 'ScenarioCatalog':
+        """cached catalog, None if missing, outdated or incompatible"""
+        try:
+            with open(path or ScenarioCatalog.default_path(), "r") as f:
+                cached = json.load(f)
+            if cached.get("version") != CATALOG_VERSION \
+               or time.time() - cached["built_at"] > CATALOG_MAX_AGE:
+                return None
+            entries = [ScenarioEntry(*e) for e in cached["entries"]]
+            return ScenarioCatalog(entries, cached["built_at"])
+        except Exception as e:
+            debug_print("could not load cached scenario catalog: {}".format(e))
+            return None
+
+    def save(self, path: str = None):
+        path = path or ScenarioCatalog.default_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": CATALOG_VERSION,
+                "built_at": self.built_at,
+                "entries": [[e.path, e.scenario_id, e.prompt] for e in self.entries],
+            }, f)
+        os.replace(tmp_path, path)
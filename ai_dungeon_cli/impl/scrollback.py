@@ -0,0 +1,110 @@
+import mmap
+import tempfile
+from array import array
+from typing import Iterator, List, Tuple
+
+
+# -------------------------------------------------------------------------
+# ENTRY
+
+class ScrollbackEntry:
+    __slots__ = ('text', 'paragraph_spacing')
+
+    def __init__(self, text: str, paragraph_spacing: bool = False):
+        self.text = text
+        self.paragraph_spacing = paragraph_spacing
+
+
+# -------------------------------------------------------------------------
+# STORE
+
+class Scrollback:
+    """bounded store of the blocks of text displayed during a session
+
+    The last `capacity` entries are kept in memory in a ring buffer. Older ones
+    are spilled to a (temporary, unless `spill_path` is given) file, read back
+    through a memory map. Only an offset per spilled entry stays resident.
+    """
+
+    def __init__(self, capacity: int = 100, spill_path: str = None):
+        self.capacity = capacity
+        self._ring: List[ScrollbackEntry] = [None] * capacity
+        self._count = 0
+
+        if spill_path:
+            self._spill_file = open(spill_path, 'w+b')
+        else:
+            self._spill_file = tempfile.TemporaryFile()
+        self._spill_offsets = array('Q')
+        self._spill_size = 0
+        self._mmap = None
+        self._mmap_size = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, text: str, paragraph_spacing: bool = False):
+        slot = self._count % self.capacity
+        evicted = self._ring[slot]
+        if evicted is not None:
+            self._spill(evicted)
+        self._ring[slot] = ScrollbackEntry(text, paragraph_spacing)
+        self._count += 1
+
+    def __getitem__(self, i: int) -> ScrollbackEntry:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("scrollback index out of range")
+        if i >= self._count - self.capacity:
+            return self._ring[i % self.capacity]
+        return self._read_spilled(i)
+
+    def entries(self, start: int, stop: int) -> List[ScrollbackEntry]:
+        start = max(0, start)
+        stop = min(self._count, stop)
+        return [self[i] for i in range(start, stop)]
+
+    def page(self, page: int, page_size: int = 10) -> Tuple[int, int, List[ScrollbackEntry]]:
+        """(page, number of pages, entries) for `page`, page 1 being the most recent one
+
+        Out of range pages get clamped.
+        """
+        nb_pages = max(1, -(-self._count // page_size))
+        page = min(max(1, page), nb_pages)
+        stop = self._count - (page - 1) * page_size
+        return page, nb_pages, self.entries(stop - page_size, stop)
+
+    def recent(self) -> Iterator[ScrollbackEntry]:
+        """in-memory entries, most recent first"""
+        for i in range(self._count - 1, max(-1, self._count - self.capacity - 1), -1):
+            yield self._ring[i % self.capacity]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._spill_file.close()
+
+    def _spill(self, entry: ScrollbackEntry):
+        data = (b'\x01' if entry.paragraph_spacing else b'\x00') + entry.text.encode('utf8')
+        self._spill_file.seek(self._spill_size)
+        self._spill_file.write(data)
+        self._spill_offsets.append(self._spill_size)
+        self._spill_size += len(data)
+
+    def _read_spilled(self, i: int) -> ScrollbackEntry:
+        if self._mmap_size < self._spill_size:
+            self._spill_file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap_size = self._spill_size
+
+        start = self._spill_offsets[i]
+        if i + 1 < len(self._spill_offsets):
+            end = self._spill_offsets[i + 1]
+        else:
+            end = self._spill_size
+        data = self._mmap[start:end]
+        return ScrollbackEntry(data[1:].decode('utf8'), data[0] == 1)
@@ -0,0 +1,135 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List
+
+from impl.utils.debug_print import debug_print
+from impl.utils.paths import data_dir
+
+
+# -------------------------------------------------------------------------
+# EXCEPTIONS
+
+class StoryIndexUnavailable(Exception):
+    """raise this when the sqlite3 module was built without full-text search support"""
+
+
+# -------------------------------------------------------------------------
+# RESULT
+
+class SearchResult:
+    __slots__ = ('adventure_id', 'turn', 'snippet')
+
+    def __init__(self, adventure_id: str, turn: int, snippet: str):
+        self.adventure_id = adventure_id
+        self.turn = turn
+        self.snippet = snippet
+
+    def __str__(self):
+        return "[{} #{}] {}".format(self.adventure_id, self.turn, self.snippet)
+
+
+# -------------------------------------------------------------------------
+# INDEX
+
+class StoryIndex:
+    """local journal of the story text of all adventures, with a full-text index
+
+    Backed by a sqlite FTS5 table, so the inverted index gets updated
+    incrementally. Writes are done from a background thread so that indexing
+    never slows down a turn, searches are done directly.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or StoryIndex.default_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = self._connect()
+        self._init_schema(self._conn)
+        self._pending = queue.Queue()
+        self._thread = None
+
+    @staticmethod
+    def default_path() -> str:
+        return os.path.join(data_dir(), "stories.db")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _init_schema(conn):
+        try:
+            with conn:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS turns"
+                             " USING fts5(text, adventure_id UNINDEXED, turn UNINDEXED, created_at UNINDEXED)")
+                conn.execute("CREATE TABLE IF NOT EXISTS adventures"
+                             " (adventure_id TEXT PRIMARY KEY, nb_turns INTEGER NOT NULL)")
+        except sqlite3.OperationalError as e:
+            raise StoryIndexUnavailable("Full-text search is not supported by this sqlite: {}".format(e))
+
+    # ---------------------------------------------------------------------
+    # WRITE
+
+    def add(self, adventure_id: str, text: str):
+        """queue `text` as the next turn of `adventure_id`, returns immediately"""
+        if not adventure_id or not text:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="story-indexer", daemon=True)
+            self._thread.start()
+        self._pending.put((adventure_id, text, time.time()))
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            item = self._pending.get()
+            if item is None:
+                conn.close()
+                self._pending.task_done()
+                return
+            try:
+                self._insert(conn, *item)
+            except sqlite3.Error as e:
+                debug_print("could not index story text: {}".format(e))
+            self._pending.task_done()
+
+    @staticmethod
+    def _insert(conn, adventure_id: str, text: str, created_at: float):
+        with conn:
+            row = conn.execute("SELECT nb_turns FROM adventures WHERE adventure_id = ?",
+                               (adventure_id,)).fetchone()
+            turn = row[0] + 1 if row else 1
+            conn.execute("INSERT OR REPLACE INTO adventures (adventure_id, nb_turns) VALUES (?, ?)",
+                         (adventure_id, turn))
+            conn.execute("INSERT INTO turns (text, adventure_id, turn, created_at) VALUES (?, ?, ?, ?)",
+                         (text, adventure_id, turn, created_at))
+
+    def flush(self):
+        """block until all queued turns are indexed"""
+        self._pending.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join()
+            self._thread = None
+        self._conn.close()
+
+    # ---------------------------------------------------------------------
+    # READ
+
+    def search(self, terms: str, limit: int = 10) -> List[SearchResult]:
+        """turns containing all of `terms`, best matches first"""
+        words = terms.split()
+        if not words:
+            return []
+        # NB: quoted, so that user input is never interpreted as FTS5 syntax
+        query = ' '.join('"' + w.replace('"', '""') + '"' for w in words)
+        rows = self._conn.execute(
+            "SELECT adventure_id, turn, snippet(turns, 0, '[', ']', '...', 12)"
+            " FROM turns WHERE turns MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit)).fetchall()
+        return [SearchResult(*row) for row in rows]
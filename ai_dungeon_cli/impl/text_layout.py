@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from typing import List
+
+from impl.scrollback import Scrollback
+
+
+# -------------------------------------------------------------------------
+# FNS
+
+def wrap_paragraph(paragraph: str, width: int) -> List[str]:
+    """greedy word wrap, single pass over the words of `paragraph`
+
+    Lines only get broken on whitespace (collapsed to single spaces), too long
+    words being split. Unlike `textwrap.wrap`, hyphenated words are never
+    broken after their hyphens.
+    """
+    width = max(1, width)
+    lines = []
+    current = []
+    current_len = 0
+    for word in paragraph.split():
+        if len(word) > width:
+            if current:
+                room = width - current_len - 1
+                if room > 0:
+                    current.append(word[:room])
+                    word = word[room:]
+                lines.append(' '.join(current))
+                current = []
+                current_len = 0
+            cut = (len(word) - 1) // width * width
+            lines.extend(word[i:i + width] for i in range(0, cut, width))
+            word = word[cut:]
+        if current and current_len + 1 + len(word) > width:
+            lines.append(' '.join(current))
+            current = []
+            current_len = 0
+        current_len += len(word) + (1 if current else 0)
+        current.append(word)
+    if current:
+        lines.append(' '.join(current))
+    return lines
+
+
+# -------------------------------------------------------------------------
+# LAYOUT ENGINE
+
+class TextLayout:
+    """wraps text to the terminal width, caching wrapped paragraphs
+
+    Wrapped paragraphs are cached by (text, width), so re-displaying past output
+    after a resize only wraps paragraphs that were never seen at that width.
+    Displayed blocks of text are recorded in a `Scrollback`, the last
+    `scrollback_size` of them staying in memory to redraw the visible part of
+    the screen.
+    """
+
+    def __init__(self, cache_size: int = 512, scrollback_size: int = 100):
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self.scrollback = Scrollback(scrollback_size)
+
+    def wrap(self, paragraph: str, width: int) -> List[str]:
+        key = (paragraph, width)
+        lines = self._cache.get(key)
+        if lines is None:
+            lines = wrap_paragraph(paragraph, width)
+            self._cache[key] = lines
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return lines
+
+    def layout(self, text: str, width: int, paragraph_spacing: bool = False) -> List[str]:
+        """lines to display for `text`
+
+        With `paragraph_spacing`, each paragraph is followed by an empty line (story
+        output), otherwise only the whole block is (basic output).
+        """
+        lines = []
+        for paragraph in text.split("\n"):
+            wrapped = self.wrap(paragraph, width)
+            if paragraph_spacing:
+                lines.extend(wrapped)
+                lines.append('')
+            else:
+                lines.extend(wrapped or [''])
+        if not paragraph_spacing:
+            lines.append('')
+        return lines
+
+    def add(self, text: str, width: int, paragraph_spacing: bool = False) -> List[str]:
+        self.scrollback.append(text, paragraph_spacing)
+        return self.layout(text, width, paragraph_spacing)
+
+    def visible_lines(self, width: int, height: int) -> List[str]:
+        """re-layout the most recent blocks, just enough of them to fill `height` lines"""
+        blocks = []
+        nb_lines = 0
+        for entry in self.scrollback.recent():
+            block = self.layout(entry.text, width, entry.paragraph_spacing)
+            blocks.append(block)
+            nb_lines += len(block)
+            if nb_lines >= height:
+                break
+        lines = [line for block in reversed(blocks) for line in block]
+        return lines[-height:]
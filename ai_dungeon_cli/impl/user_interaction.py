@@ -1,11 +1,21 @@
 import os
 import sys
+import select
 from abc import ABC, abstractmethod
-import textwrap
 import shutil
+import signal
+import threading
+import json
+from collections import deque
+from typing import Dict
 
-from time import sleep
-from random import randint
+from time import monotonic, sleep
+
+from impl.text_layout import TextLayout
+from impl.scrollback import Scrollback
+from impl.utils.resources import load_splash
+from impl.utils.terminal import clear_screen
+from impl.utils.profiling import profiled, profiled_input
 
 # NB: import doesn't appear to be used but in fact overrides definition for
 # the input() method
@@ -28,6 +38,24 @@ class UserIo(ABC):
     def handle_story_output(self, text: str):
         self.handle_basic_output(text)
 
+    def handle_error_output(self, text: str):
+        self.handle_basic_output(text)
+
+    def handle_options_output(self, options: Dict[str, str]):
+        self.handle_basic_output("\n".join(k + ") " + v for k, v in options.items()))
+
+    def handle_timing(self, name: str, seconds: float):
+        pass
+
+    def display_history(self, page: int = 1):
+        pass
+
+    def display_splash(self):
+        pass
+
+    def clear(self):
+        pass
+
 
 # -------------------------------------------------------------------------
 # IMPLEM: BASIC
@@ -35,75 +63,287 @@ class UserIo(ABC):
 class TermIo(UserIo):
     def __init__(self, prompt: str = ''):
         self.prompt = prompt
+        self.layout = TextLayout()
+        self.terminal_size = None
+        self.reading_input = False
+        self.needs_redraw = False
+        self.watches_resize = self._watch_resize()
 
     def handle_user_input(self) -> str:
-        user_input = input(self.prompt)
+        self.reading_input = True
+        try:
+            with profiled_input():
+                user_input = input(self.prompt)
+        finally:
+            self.reading_input = False
         print()
         return user_input
 
     def handle_basic_output(self, text: str):
-        for line in text.split("\n"):
-            print("\n".join(textwrap.wrap(line, self.get_width())))
-        print()
+        with profiled("layout"):
+            lines = self.layout.add(text, self.get_width())
+        self.write_lines(lines)
 
     # def handle_story_output(self, text: str):
     #     self.handle_basic_output(text)
 
+    def display_history(self, page: int = 1, page_size: int = 10):
+        """display past output, page 1 being the most recent one"""
+        page, nb_pages, entries = self.layout.scrollback.page(page, page_size)
+        width = self.get_width()
+        lines = ["--- history page {}/{} ---".format(page, nb_pages), '']
+        with profiled("layout"):
+            for entry in entries:
+                lines.extend(self.layout.layout(entry.text, width, entry.paragraph_spacing))
+        lines.append("--- end of history page {}/{} ---".format(page, nb_pages))
+        lines.append('')
+        self.write_lines(lines)
+
+    def write_lines(self, lines):
+        self.redraw_if_resized()
+        with profiled("render"):
+            sys.stdout.write(''.join(line + "\n" for line in lines))
+            sys.stdout.flush()
+
+    def get_terminal_size(self):
+        # NB: when resizes get notified, the size is only re-queried after one
+        if self.terminal_size is None or not self.watches_resize:
+            self.terminal_size = shutil.get_terminal_size((80, 20))
+        return self.terminal_size
+
     def get_width(self):
-        terminal_size = shutil.get_terminal_size((80, 20))
-        return terminal_size.columns
+        return self.get_terminal_size().columns
 
-    def display_splash(self):
-        filename = os.path.dirname(os.path.realpath(__file__))
-        locale = None
-        term = None
-        if "LC_ALL" in os.environ:
-            locale = os.environ["LC_ALL"]
-        if "TERM" in os.environ:
-            term = os.environ["TERM"]
-
-        if locale == "C" or (term and term.startswith("vt")):
-            filename += "/../res/opening-ascii.txt"
-        else:
-            filename += "/../res/opening-utf8.txt"
+    def get_height(self):
+        return self.get_terminal_size().lines
+
+    def _watch_resize(self) -> bool:
+        if not hasattr(signal, "SIGWINCH") \
+           or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signal.SIGWINCH, self._on_resize)
+        return True
+
+    def _on_resize(self, signum, frame):
+        # NB: the main thread may be in the middle of a write to stdout, so the
+        # redraw waits for a safe point: either right away if blocked waiting for
+        # input, or before the next write
+        self.terminal_size = None
+        self.needs_redraw = True
+        if self.reading_input:
+            self.redraw_if_resized()
+
+    def redraw_if_resized(self):
+        if self.needs_redraw:
+            self.needs_redraw = False
+            self.redraw()
 
-        with open(filename, "r", encoding="utf8") as splash_image:
-            print(splash_image.read())
+    def redraw(self):
+        """relayout the visible part of the scrollback to the current terminal width"""
+        self.clear()
+        with profiled("layout"):
+            lines = self.layout.visible_lines(self.get_width(), self.get_height() - 1)
+        self.write_lines(lines)
+        if self.reading_input:
+            sys.stdout.write(self.prompt + readline.get_line_buffer())
+            sys.stdout.flush()
+
+    def handle_options_output(self, options: Dict[str, str]):
+        self.write_lines([k + ") " + v for k, v in options.items()])
+
+    def display_splash(self):
+        if self.get_width() < 80:
+            return
+        with profiled("render"):
+            sys.stdout.write(load_splash() + "\n")
+            sys.stdout.flush()
 
     def clear(self):
-        if os.name == "nt":
-            _ = os.system("cls")
-        else:
-            _ = os.system("clear")
+        clear_screen()
 
 
 # -------------------------------------------------------------------------
 # IMPLEM: SLOW TYPING EFFECT
 
 class TermIoSlowStory(TermIo):
-    def __init__(self, prompt: str = ''):
-        sys.stdout = Unbuffered(sys.stdout)
+    def __init__(self, prompt: str = '', chars_per_second: int = 40):
         super().__init__(prompt)
+        self.renderer = SlowTypingRenderer(sys.stdout, chars_per_second)
+
+    def handle_user_input(self) -> str:
+        self.wait_for_renderer()
+        return super().handle_user_input()
+
+    def write_lines(self, lines):
+        self.wait_for_renderer()
+        super().write_lines(lines)
 
     def handle_story_output(self, text: str):
-        for line in text.split("\n"):
-            for line2 in textwrap.wrap(line, self.get_width()):
-                for letter in line2:
-                    print(letter, end='')
-                    sleep(randint(2, 10)*0.005)
-                print()
-            print()
-
-
-# allow unbuffered output for slow typing effect
-class Unbuffered(object):
-   def __init__(self, stream):
-       self.stream = stream
-   def write(self, data):
-       self.stream.write(data)
-       self.stream.flush()
-   def writelines(self, datas):
-       self.stream.writelines(datas)
-       self.stream.flush()
-   def __getattr__(self, attr):
-       return getattr(self.stream, attr)
+        # NB: returns as soon as the text is queued, typing happens in the renderer thread
+        with profiled("layout"):
+            lines = self.layout.add(text, self.get_width(), paragraph_spacing=True)
+        self.renderer.write(''.join(line + "\n" for line in lines))
+
+    def redraw(self):
+        # NB: text being typed would get mixed up with the redrawn one
+        if self.renderer.wait(0):
+            super().redraw()
+        else:
+            self.needs_redraw = True
+
+    def wait_for_renderer(self):
+        """block until the renderer is done typing, any keypress skips to the end"""
+        try:
+            while not self.renderer.wait(self.renderer.frame_duration):
+                if key_pressed():
+                    self.renderer.skip()
+        except KeyboardInterrupt:
+            self.renderer.skip()
+            self.renderer.wait()
+            raise
+
+
+class SlowTypingRenderer:
+    """types text out at a constant rate, in a background thread
+
+    Text is written in frame-sized chunks so that there is only one write and
+    one flush per frame instead of per character.
+    """
+
+    def __init__(self, stream, chars_per_second: int = 40, frames_per_second: int = 20):
+        self.stream = stream
+        self.frame_duration: float = 1.0 / frames_per_second
+        self.chars_per_frame: int = max(1, round(chars_per_second / frames_per_second))
+
+        self._pending = deque()
+        self._has_pending = threading.Condition()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._skip = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name="slow-typing-renderer", daemon=True)
+        self._thread.start()
+
+    def write(self, text: str):
+        with self._has_pending:
+            self._pending.append(text)
+            self._skip.clear()
+            self._idle.clear()
+            self._has_pending.notify()
+
+    def skip(self):
+        self._skip.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._idle.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._has_pending:
+                while not self._pending:
+                    self._skip.clear()
+                    self._idle.set()
+                    self._has_pending.wait()
+                text = self._pending.popleft()
+            self._type(text)
+
+    def _type(self, text: str):
+        pos = 0
+        next_frame = monotonic()
+        while pos < len(text):
+            if self._skip.is_set():
+                chunk = text[pos:]
+            else:
+                chunk = text[pos:pos + self.chars_per_frame]
+            with profiled("render"):
+                self.stream.write(chunk)
+                self.stream.flush()
+            pos += len(chunk)
+
+            next_frame += self.frame_duration
+            delay = next_frame - monotonic()
+            if delay > 0 and not self._skip.is_set():
+                sleep(delay)
+
+
+# -------------------------------------------------------------------------
+# IMPLEM: JSON LINES
+
+class JsonLinesIo(UserIo):
+    """machine-readable I/O, for driving the game from another program
+
+    Each output is a single JSON object on its own line, with an `event` field
+    (`story`, `output`, `options`, `prompt`, `error`, `history` or `timing`).
+    Inputs are read one per line, either as raw text or as a JSON object with a
+    `text` field.
+    """
+
+    def __init__(self, prompt: str = '', in_stream=None, out_stream=None):
+        self.prompt = prompt
+        self.in_stream = in_stream or sys.stdin
+        self.out_stream = out_stream or sys.stdout
+        self.scrollback = Scrollback()
+
+    def emit(self, event: str, **fields):
+        with profiled("render"):
+            self.out_stream.write(json.dumps({"event": event, **fields}) + "\n")
+            self.out_stream.flush()
+
+    def handle_user_input(self) -> str:
+        self.emit("prompt", prompt=self.prompt)
+        with profiled_input():
+            line = self.in_stream.readline()
+        if not line:
+            raise EOFError
+        line = line.rstrip("\n")
+        if line.startswith("{"):
+            try:
+                return str(json.loads(line).get("text", ""))
+            except (ValueError, AttributeError):
+                pass
+        return line
+
+    def handle_basic_output(self, text: str):
+        self.scrollback.append(str(text))
+        self.emit("output", text=str(text))
+
+    def handle_story_output(self, text: str):
+        self.scrollback.append(text, paragraph_spacing=True)
+        self.emit("story", text=text)
+
+    def handle_error_output(self, text: str):
+        self.emit("error", message=str(text))
+
+    def handle_options_output(self, options: Dict[str, str]):
+        self.emit("options", options=options)
+
+    def handle_timing(self, name: str, seconds: float):
+        self.emit("timing", name=name, seconds=round(seconds, 6))
+
+    def display_history(self, page: int = 1, page_size: int = 10):
+        page, nb_pages, entries = self.scrollback.page(page, page_size)
+        self.emit("history", page=page, pages=nb_pages,
+                  entries=[{"event": "story" if e.paragraph_spacing else "output", "text": e.text}
+                           for e in entries])
+
+
+# -------------------------------------------------------------------------
+# UTILS: KEYBOARD
+
+def key_pressed() -> bool:
+    """non-blocking check for a keypress, consuming it if there was one"""
+    if os.name == "nt":
+        import msvcrt
+        if msvcrt.kbhit():
+            msvcrt.getwch()
+            return True
+        return False
+
+    if not sys.stdin.isatty():
+        return False
+    readable, _, _ = select.select([sys.stdin], [], [], 0)
+    if readable:
+        # NB: in canonical mode, the terminal only hands over input on <Enter>
+        sys.stdin.readline()
+        return True
+    return False
@@ -0,0 +1,170 @@
+import sys
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, List
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: time spent decoding happens in the connection thread, while the main
+# thread is waiting on the network, so it is a part of `network`
+PHASES = ["network", "json_decode", "layout", "render"]
+
+
+# -------------------------------------------------------------------------
+# PROFILER
+
+class SessionProfiler:
+    """instruments a whole session, writing reports on `stop`
+
+    - wall time of each turn, split by phase (see `PHASES`), time spent waiting
+      for user input being left out
+    - a cProfile of the main thread (`<prefix>.pstats`)
+    - stacks of all threads sampled every `sampling_interval` seconds, in
+      folded format (`<prefix>.folded`), each stack being prefixed by its turn
+      and thread name, e.g. for use by flamegraph.pl or speedscope
+    - the per-turn split (`<prefix>.turns.csv`)
+
+    A turn starts when user input gets submitted, and ends when the next one
+    gets asked for. Turn 0 is the startup (login, menus and initial story).
+    """
+
+    def __init__(self, prefix: str, sampling_interval: float = 0.005):
+        self.prefix = prefix
+        self.sampling_interval = sampling_interval
+
+        self._lock = threading.Lock()
+        self.turn: int = 0
+        self.turn_start: float = perf_counter()
+        self.turns: List[Dict[str, float]] = []
+        self.phases: Dict[str, float] = Counter()
+        self.waiting_input: bool = False
+        self.stacks = Counter()
+
+        self.cprofile = cProfile.Profile()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_stacks, name="profiler-sampler", daemon=True)
+
+    def start(self):
+        self._sampler.start()
+        self.cprofile.enable()
+
+    def stop(self):
+        self.cprofile.disable()
+        self._stop.set()
+        self._sampler.join()
+        if not self.waiting_input:
+            self._end_turn()
+
+        self.cprofile.dump_stats(self.prefix + ".pstats")
+        with open(self.prefix + ".folded", "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("{} {}\n".format(stack, count))
+        with open(self.prefix + ".turns.csv", "w") as f:
+            f.write(",".join(["turn", "wall"] + PHASES + ["other"]) + "\n")
+            for i, turn in enumerate(self.turns):
+                f.write(",".join(["{}".format(i)] + ["{:.6f}".format(turn[k]) for k in ["wall"] + PHASES + ["other"]]) + "\n")
+        self.print_summary()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def input_requested(self):
+        self._end_turn()
+        self.waiting_input = True
+
+    def input_received(self):
+        self.waiting_input = False
+        with self._lock:
+            self.turn += 1
+            self.turn_start = perf_counter()
+
+    def _end_turn(self):
+        with self._lock:
+            turn = {phase: self.phases[phase] for phase in PHASES}
+            turn["wall"] = perf_counter() - self.turn_start
+            # NB: json_decode is already counted in network
+            turn["other"] = max(0, turn["wall"] - turn["network"] - turn["layout"] - turn["render"])
+            self.turns.append(turn)
+            self.phases = Counter()
+
+    def _sample_stacks(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.sampling_interval):
+            if self.waiting_input:
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            prefix = "turn-{}".format(self.turn)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append("{} ({}:{})".format(code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                calls.append(names.get(thread_id, str(thread_id)))
+                calls.append(prefix)
+                self.stacks[";".join(reversed(calls))] += 1
+
+    def print_summary(self):
+        totals = Counter()
+        for turn in self.turns:
+            totals.update(turn)
+        wall = totals["wall"] or 1
+        out = sys.stderr
+        out.write("Profiled {} turns, {:.3f}s of wall time (excluding user input):\n".format(len(self.turns), totals["wall"]))
+        for phase in PHASES + ["other"]:
+            out.write("  {:<12} {:>9.3f}s {:>5.1f}%\n".format(phase, totals[phase], 100 * totals[phase] / wall))
+        out.write("Wrote {0}.pstats, {0}.folded and {0}.turns.csv\n".format(self.prefix))
+
+
+# -------------------------------------------------------------------------
+# STATE
+
+PROFILER: SessionProfiler = None
+
+def activate_profiling(prefix: str):
+    global PROFILER
+    PROFILER = SessionProfiler(prefix)
+    PROFILER.start()
+
+def stop_profiling():
+    global PROFILER
+    if PROFILER is not None:
+        profiler = PROFILER
+        PROFILER = None
+        profiler.stop()
+
+
+# -------------------------------------------------------------------------
+# FNS
+
+@contextmanager
+def profiled(phase: str):
+    if PROFILER is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        # NB: PROFILER may have been stopped in the meantime
+        profiler = PROFILER
+        if profiler is not None:
+            profiler.add(phase, perf_counter() - start)
+
+@contextmanager
+def profiled_input():
+    if PROFILER is not None:
+        PROFILER.input_requested()
+    try:
+        yield
+    finally:
+        if PROFILER is not None:
+            PROFILER.input_received()
@@ -0,0 +1,39 @@
+import os
+from functools import lru_cache
+
+try:
+    from importlib.resources import files as _resource_files
+except ImportError:
+    # python < 3.9
+    _resource_files = None
+    from importlib.resources import read_text as _read_text
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: `res` is a sibling of `impl`, wherever the package got imported from
+RES_PACKAGE = __name__[:__name__.rindex("impl.utils")] + "res"
+
+
+# -------------------------------------------------------------------------
+# FNS
+
+@lru_cache(maxsize=None)
+def load_text(filename: str) -> str:
+    if _resource_files is not None:
+        return _resource_files(RES_PACKAGE).joinpath(filename).read_text(encoding="utf8")
+    return _read_text(RES_PACKAGE, filename, encoding="utf8")
+
+
+@lru_cache(maxsize=None)
+def splash_filename() -> str:
+    locale = os.environ.get("LC_ALL")
+    term = os.environ.get("TERM")
+    if locale == "C" or (term and term.startswith("vt")):
+        return "opening-ascii.txt"
+    return "opening-utf8.txt"
+
+
+def load_splash() -> str:
+    return load_text(splash_filename())
@@ -0,0 +1,62 @@
+import os
+import sys
+from functools import lru_cache
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+ANSI_CLEAR = "\033[H\033[2J"
+
+
+# -------------------------------------------------------------------------
+# FNS: CAPABILITIES
+
+def _enable_windows_vt_mode() -> bool:
+    """Windows 10+ consoles only interpret ANSI sequences once asked to"""
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11) # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+        return bool(kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING))
+    except (ImportError, AttributeError, OSError):
+        return False
+
+
+@lru_cache(maxsize=None)
+def clear_sequence():
+    """escape sequence to clear the screen, resolved once per process
+
+    Returns None if the terminal can't be cleared in-process.
+    """
+    if os.name == "nt":
+        return ANSI_CLEAR if _enable_windows_vt_mode() else None
+
+    try:
+        import curses
+        curses.setupterm(fd=sys.stdout.fileno())
+        seq = curses.tigetstr("clear")
+        if seq:
+            return seq.decode("latin-1")
+    except Exception:
+        # NB: curses not available, unknown TERM or stdout not being a real file
+        pass
+    return ANSI_CLEAR
+
+
+# -------------------------------------------------------------------------
+# FNS: ACTIONS
+
+def clear_screen(stream=None):
+    stream = stream or sys.stdout
+    seq = clear_sequence()
+    if seq is None:
+        # last resort, spawns a subprocess
+        os.system("cls" if os.name == "nt" else "clear")
+        return
+    stream.write(seq)
+    stream.flush()
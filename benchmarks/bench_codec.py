@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""Decoding time of websocket answers for adventures of increasing sizes, per JSON codec.
+
+    $ python3 benchmarks/bench_codec.py
+"""
+
+import os
+import sys
+import json
+import timeit
+
+main_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'ai_dungeon_cli')
+module_path = os.path.abspath(main_path)
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from impl.api.codec import CODECS, is_available
+
+
+ACTION_TEXT = ("You walk down the corridor, the torch in your hand flickering as a cold draft "
+               "comes from the darkness ahead. \"Who goes there?\" a voice asks.\n")
+
+
+def make_answer(nb_actions: int) -> str:
+    actions = [{'id': str(100000 + i), 'text': ACTION_TEXT, '__typename': 'Action'}
+               for i in range(nb_actions)]
+    return json.dumps({
+        'id': '1',
+        'type': 'data',
+        'payload': {'data': {'content': {'id': 'adventure:1', 'actions': actions}}},
+    })
+
+
+def main():
+    codecs = [c for c in CODECS if is_available(c)]
+    print("{:>8} {:>10}  {}".format("actions", "size (kB)",
+                                    "  ".join("{:>12}".format(c.name) for c in codecs)))
+    for nb_actions in [1000, 10000, 50000]:
+        answer = make_answer(nb_actions)
+        timings = []
+        for codec in codecs:
+            nb_runs = max(1, 20000 // nb_actions)
+            t = timeit.timeit(lambda: codec.loads(answer), number=nb_runs) / nb_runs
+            timings.append("{:>10.2f}ms".format(t * 1000))
+        print("{:>8} {:>10}  {}".format(nb_actions, len(answer) // 1024, "  ".join(timings)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""Bytes exchanged with the API by each operation of the client, against budgets.
+
+Runs every `AiDungeonApiClient` operation against a local `StandInServer`, which
+only answers the fields asked for, and fails when the (uncompressed) bytes sent
+or received by one of them grow past its budget, e.g. because a selection set
+asks for more fields than used.
+
+    $ python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+from time import monotonic, sleep
+
+main_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'ai_dungeon_cli')
+module_path = os.path.abspath(main_path)
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from impl.api.client import AiDungeonApiClient
+from impl.api.metering import TrafficCounters
+from impl.loadtest.server import StandInServer
+
+
+# -------------------------------------------------------------------------
+# CONSTS
+
+# NB: short and fixed size stories, so that sizes only depend on the operations
+WORDS_PER_ACTION = 10
+
+# client method -> (sent, received) budgets, in uncompressed bytes
+# NB: ~20% above measured sizes, stories being made of random words
+BUDGETS = {
+    "anonymous_login": (160, 200),
+    "user_login": (350, 200),
+    "get_settings_single_player": (250, 320),
+    "get_characters": (250, 330),
+    "get_story_template_for_scenario": (210, 250),
+    "init_story": (600, 550),
+    "init_custom_story_pitch": (330, 330),
+    "perform_regular_action": (580, 550),
+    "perform_remember_action": (280, 160),
+    "perform_retry_actions": (320, 400),
+    "get_last_action_id": (220, 200),
+    "perform_alter_action": (300, 160),
+    "join_multi_adventure": (270, 190),
+    "init_story_multi_adventure": (320, 320),
+}
+
+
+# -------------------------------------------------------------------------
+# TESTS
+
+class TrafficBudgetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandInServer(latency=0, jitter=0, words_per_action=WORDS_PER_ACTION)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        # NB: no keepalive pings during the test, compression off for stable sizes
+        self.api = AiDungeonApiClient(url=self.server.url, ping_interval=3600,
+                                      use_schema_cache=False, compression="off")
+
+    def tearDown(self):
+        self.api.close()
+
+    def measure(self, call, *args):
+        """(result, bytes sent, bytes received) by operations during `call(*args)`"""
+        before = self.totals()
+        result = call(*args)
+        if hasattr(result, '__next__'):
+            result = list(result)
+        self.wait_for_completion()
+        sent, received = self.totals()
+        return result, sent - before[0], received - before[1]
+
+    def wait_for_completion(self, timeout: float = 5):
+        """wait for the 'complete' messages, which can come after results are returned"""
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            client = self.api.supervisor.client
+            if client is None or not client.transport.operation_names:
+                return
+            sleep(0.01)
+
+    def totals(self):
+        sent = received = 0
+        for name, traffic in self.api.traffic.operations.items():
+            if name != TrafficCounters.CONNECTION:
+                sent += traffic.sent_raw
+                received += traffic.received_raw
+        return sent, received
+
+    def assertWithinBudget(self, method: str, *args):
+        result, sent, received = self.measure(getattr(self.api, method), *args)
+        sent_budget, received_budget = BUDGETS[method]
+        self.assertLessEqual(sent, sent_budget, "{} sent {} bytes".format(method, sent))
+        self.assertLessEqual(received, received_budget, "{} received {} bytes".format(method, received))
+        return result
+
+    def new_adventure(self):
+        adventure_id, _, _, _ = self.api.init_story("scenario:fantasy:knight", "You are Bob.")
+        return adventure_id
+
+    def test_login(self):
+        self.assertWithinBudget("anonymous_login")
+        self.assertWithinBudget("user_login", "bob@example.com", "password")
+
+    def test_menus(self):
+        self.assertWithinBudget("get_settings_single_player")
+        self.assertWithinBudget("get_characters", "scenario:fantasy")
+        self.assertWithinBudget("get_story_template_for_scenario", "scenario:fantasy:knight")
+
+    def test_init_story(self):
+        self.assertWithinBudget("init_story", "scenario:fantasy:knight", "You are Bob.")
+        adventure_id, _ = self.api.create_adventure("scenario:custom", None)
+        self.assertWithinBudget("init_custom_story_pitch", adventure_id, "You are Bob, a baker.")
+
+    def test_actions(self):
+        adventure_id = self.new_adventure()
+        self.assertWithinBudget("perform_regular_action", adventure_id, "do", "open the door")
+        self.assertWithinBudget("perform_remember_action", "I am brave", adventure_id)
+        self.assertWithinBudget("perform_retry_actions", adventure_id, 1)
+        action_id = self.assertWithinBudget("get_last_action_id", adventure_id)
+        self.assertWithinBudget("perform_alter_action", adventure_id, action_id, "The door opens.")
+
+    def test_multiplayer(self):
+        adventure_id = self.new_adventure()
+        self.assertWithinBudget("join_multi_adventure", adventure_id)
+        self.assertWithinBudget("init_story_multi_adventure", adventure_id)
+
+
+if __name__ == '__main__':
+    unittest.main()